@@ -4,20 +4,26 @@ from pathlib import Path
 import modal
 import modal.experimental
 
+from .gateway import LLMClient, LocalYOLOClient, YOLOClient
 from .llm import LLMServer
 from .llm import app as llm_app
+from .match import MatchEngine
+from .profiling import create_profiler, profile_enabled, profiling_secret, save_profiler
+from .startup import StartupProfiler, format_report, profile_imports
+from .tracing import Tracer
 from .utils import (
-    CHARACTER_TO_ID,
     COMBOS,
     SPECIAL_MOVES,
-    GameInfo,
-    PlayerState,
-    create_messages,
+    X_SIZE,
+    Y_SIZE,
     minutes,
     region,
 )
 from .yolo import YOLOServer
 from .yolo import app as yolo_app
+from .yolo import cache_path as yolo_cache_path
+from .yolo import cache_volume as yolo_cache_volume
+from .yolo import cpu_model_name as yolo_cpu_model_name
 
 # Modal setup
 
@@ -67,6 +73,8 @@ image = (
         "diambra-arena==2.2.7",
         "fastapi[standard]==0.116.1",
         "numpy==2.3.1",
+        "onnx==1.17.0",  # cpu detector backend
+        "onnxruntime==1.21.0",
         "websockets==15.0.1",
     )
     # engine
@@ -102,79 +110,201 @@ image = (
     )
 )
 
+cache_path = Path("/cache")
+cache_volume = modal.Volume.from_name("sf3-web-cache", create_if_missing=True)
+traces_path = cache_path / "traces"
+profiles_path = cache_path / "profiles"
+
+# SF3_TRACE=1 modal deploy -m src.app to write a perfetto trace per session
+trace_sessions = os.environ.get("SF3_TRACE", "0") == "1"
+tracing_secret = modal.Secret.from_dict({"SF3_TRACE": "1" if trace_sessions else "0"})
+
+# helper fns
+
+
+def create_tracer(name: str) -> Tracer:
+    import time
+    import uuid
+
+    return Tracer(
+        traces_path / f"{name}-{int(time.time())}-{uuid.uuid4().hex[:8]}.json"
+    )
+
+
+async def save_tracer(tracer: Tracer | None):
+    if tracer is None:
+        return
+    tracer.save()
+    await cache_volume.commit.aio()
+
+
+async def create_sandbox() -> modal.Sandbox:
+    print("Creating sandbox...")
+    engine_port = 50051
+    sandbox = modal.Sandbox.create(
+        "/bin/diambraEngineServer",
+        app=engine_app,
+        image=engine_image,
+        timeout=60 * minutes,
+        region=region,
+        unencrypted_ports=[engine_port],
+        verbose=True,
+    )
+    tunnels = sandbox.tunnels()
+    tunnel = tunnels[engine_port]
+    host, port = tunnel.tcp_socket
+    os.environ["DIAMBRA_ENVS"] = f"{host}:{port}"
+    print(f"Created sandbox {sandbox.object_id} at {host}:{port}")
+    return sandbox
+
+
 # inference
 
 max_inputs = 1
+yolo_encoding = "png"  # detector rpc payload, lossless, see codec.py
+detector_backend = "remote"  # or "cpu" to run yolo in-process, see LocalYOLOClient
+cpu_detector_sessions = 1  # one per concurrent session, max_inputs is 1
+cpu_detector_threads = 2
+web_cpu = (
+    1 + cpu_detector_sessions * cpu_detector_threads
+    if detector_backend == "cpu"
+    else None
+)
+frame_metrics_limit = 600  # ~10 minutes of one report per second
+frame_metrics_recent = 10
+# fields of a browser report, see frameSink.js
+frame_metrics_counts = ["seq", "n_received", "n_displayed", "n_dropped"]
+frame_metrics_latencies = ["decode_ms", "display_ms", "e2e_ms"]  # p50, p90, p99
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_frame_metrics(payload) -> dict:
+    # sent by the client, so only the known numeric fields are kept
+    if not isinstance(payload, dict):
+        return {}
+    metrics = {
+        key: payload[key] for key in frame_metrics_counts if is_number(payload.get(key))
+    }
+    for key in frame_metrics_latencies:
+        summary = payload.get(key)
+        if isinstance(summary, dict):
+            metrics[key] = {
+                p: summary[p]
+                for p in ["p50", "p90", "p99"]
+                if is_number(summary.get(p))
+            }
+    return metrics
 
 
 @app.cls(
     image=image,
     region=region,
+    volumes={cache_path: cache_volume, yolo_cache_path: yolo_cache_volume},
+    cpu=web_cpu,
+    secrets=[tracing_secret, profiling_secret],
     scaledown_window=60 * minutes,
     timeout=24 * 60 * minutes,
+    enable_memory_snapshot=True,
 )
 @modal.concurrent(max_inputs=max_inputs)
 class Web:
-    @modal.enter()
+    @modal.enter(snap=True)
     def enter(
         self,
     ):
+        import collections
+        import json
+
+        # heavy imports and precomputation happen before the snapshot is taken,
+        # so restored containers don't pay for them on the first connection
+        self.startup_profiler = StartupProfiler("Web")
+        self.startup_profiler.import_modules(
+            ["numpy", "cv2", "fastapi", "fastapi.staticfiles", "diambra.arena"]
+        )
+        import numpy as np
+
+        from .match import encode_frame, preprocess_frame
+
+        with self.startup_profiler.step("warmup (frame encode)"):
+            frame = np.zeros((Y_SIZE, X_SIZE, 3), dtype=np.uint8)
+            encode_frame(preprocess_frame(frame)[0])
+        with self.startup_profiler.step("precompute extra moves"):
+            self.extra_moves_json = json.dumps(
+                {"combos": COMBOS, "special_moves": SPECIAL_MOVES}
+            )
+        self.startup_profiler.print_report()
+
         # assign llm and yolo to self so multiple container inputs can share them
         # initially set to None so they don't block page load, amortized by user interacting with settings
         self.llm = None
         self.yolo = None
+        self.yolo_input_size = None
+
+        self.llm_client = None
+        self.yolo_client = None
+
+        # decode/display latency reported by browsers, see frameSink.js
+        self.frame_metrics = collections.deque(maxlen=frame_metrics_limit)
+
+    @modal.method()
+    async def get_startup_report(self) -> dict:
+        return {
+            **self.startup_profiler.get_report(),
+            "imports": profile_imports(
+                ["src.utils", "cv2", "diambra.arena", "fastapi"]
+            ),
+        }
 
     async def create_llm(self):  # async to avoid blocking event loop
         print("Creating LLM...")
         if self.llm is None:
             self.llm = LLMServer()
             await self.llm.boot.remote.aio()
+            self.llm_client = LLMClient(self.llm)
         print("LLM created")
 
     async def create_yolo(self):
+        import asyncio
+
         print("Creating YOLO...")
-        if self.yolo is None:
-            self.yolo = YOLOServer()
-            await self.yolo.boot.remote.aio()
+        if self.yolo_client is None:
+            if detector_backend == "cpu":
+                # not in enter, onnxruntime thread pools can't be snapshotted
+                self.yolo_client = await asyncio.to_thread(
+                    LocalYOLOClient,
+                    yolo_cpu_model_name,
+                    cpu_detector_sessions,
+                    cpu_detector_threads,
+                )
+            else:
+                self.yolo = YOLOServer()
+                await self.yolo.boot.remote.aio()
+                # one session per container making one call per pass, so nothing to
+                # coalesce, YOLOServer still batches calls across containers
+                self.yolo_client = YOLOClient(self.yolo, max_batch_size=1)
+                await self.yolo_client.negotiate(yolo_encoding)
+            self.yolo_input_size = self.yolo_client.input_size
         print("YOLO created")
 
     @modal.asgi_app(custom_domains=["sf3.modal.dev"])
     def app(self):
         import asyncio
         import json
+        import time
         import traceback
 
-        import cv2
-        import diambra.arena as arena
         import numpy as np
-        from diambra.arena import EnvironmentSettingsMultiAgent, Roles, SpaceTypes
         from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-        from fastapi.responses import FileResponse
+        from fastapi.responses import FileResponse, Response
         from fastapi.staticfiles import StaticFiles
 
         web_app = FastAPI()
 
         # helper fns
 
-        async def create_sandbox() -> modal.Sandbox:
-            print("Creating sandbox...")
-            engine_port = 50051
-            sandbox = modal.Sandbox.create(
-                "/bin/diambraEngineServer",
-                app=engine_app,
-                image=engine_image,
-                timeout=60 * minutes,
-                region=region,
-                unencrypted_ports=[engine_port],
-                verbose=True,
-            )
-            tunnels = sandbox.tunnels()
-            tunnel = tunnels[engine_port]
-            host, port = tunnel.tcp_socket
-            os.environ["DIAMBRA_ENVS"] = f"{host}:{port}"
-            print(f"Created sandbox {sandbox.object_id} at {host}:{port}")
-            return sandbox
-
         class NumpyJSONEncoder(json.JSONEncoder):
             def default(self, obj):
                 if isinstance(obj, np.ndarray):
@@ -186,174 +316,6 @@ class Web:
         def make_json_safe(obj):
             return json.loads(json.dumps(obj, cls=NumpyJSONEncoder))
 
-        def create_initial_game_state():
-            return {
-                "status": "initializing",
-                "scores": [0, 0],
-                "winner": "",
-                "error": "",
-            }
-
-        # manages game state and communication
-
-        class GameSession:
-            def __init__(self, websocket: WebSocket):
-                self.websocket = websocket
-
-                # game state
-
-                self.env = None
-                self.sandbox = None
-                self.game_running = False
-                self.game_settings = {
-                    "player1": {
-                        "character": "Ken",
-                        "outfit": 1,
-                        "superArt": 1,
-                    },
-                    "player2": {
-                        "character": "Ken",
-                        "outfit": 1,
-                        "superArt": 1,
-                    },
-                    "humanVsLlm": True,
-                    "gamepadConnected": False,
-                    "difficulty": "expert",
-                }
-                self.game_state = create_initial_game_state()
-
-                # per frame state
-
-                self.observation = None
-                self.info = None
-
-                # transition state
-
-                self.in_transition = False
-                self.transition_start_time = None
-                self.transition_duration = 3.0  # seconds, matches frontend
-
-                # game duration state
-
-                self.player1_next_buttons = []
-                self.player2_next_buttons = []
-                self.next_buttons_limit = (
-                    20  # simply for memory, roughly length of longest combo
-                )
-                self.player1_current_action = 0
-                self.actions = {"agent_0": 0, "agent_1": 0}
-
-                self.prev_player1_state = None
-                self.prev_player2_state = None
-                self.prev_game_info = None
-
-                self.player1_recent_move_names = []
-                self.player2_recent_move_names = []
-                self.recent_move_limit = 8  # memory + min for good move variety
-
-                # communication
-
-                self.outbound_message_queue = asyncio.Queue()
-                self.stop_event = asyncio.Event()
-
-            async def send_game_state(self):
-                await self.outbound_message_queue.put(
-                    {"type": "game_state", "data": make_json_safe(self.game_state)}
-                )
-
-            async def handle_player_action(self, action_data):
-                if self.observation is None:
-                    return
-
-                if not self.game_settings["humanVsLlm"]:
-                    return
-
-                action = action_data["action"]
-
-                # super art
-
-                if action == 18:
-                    super_art_name = action_data.get("super_art")
-                    if not super_art_name:
-                        return
-
-                    p1_obs = self.observation["P1"]
-                    p1_character = CHARACTER_TO_ID[
-                        self.game_settings["player1"]["character"]
-                    ]
-                    p1_direction = "left" if p1_obs["side"] == 0 else "right"
-
-                    if (
-                        p1_character in SPECIAL_MOVES
-                        and super_art_name in SPECIAL_MOVES[p1_character]
-                    ):
-                        self.player1_next_buttons.extend(
-                            SPECIAL_MOVES[p1_character][super_art_name][p1_direction]
-                        )
-
-                # combo
-
-                elif action == 19:
-                    combo_name = action_data["combo"]
-
-                    p1_obs = self.observation["P1"]
-                    p1_character = CHARACTER_TO_ID[
-                        self.game_settings["player1"]["character"]
-                    ]
-                    p1_direction = "left" if p1_obs["side"] == 0 else "right"
-
-                    if p1_character in COMBOS and combo_name in COMBOS[p1_character]:
-                        self.player1_next_buttons.extend(
-                            COMBOS[p1_character][combo_name][p1_direction]
-                        )
-
-                # normal move
-
-                else:
-                    if action <= 8:  # directional, so don't queue
-                        self.player1_current_action = action
-                    else:  # attack moves (9-17), so queue
-                        self.player1_next_buttons.append(action)
-
-            async def cleanup_environment(self):
-                print("Cleaning up environment...")
-                if self.env:
-                    try:
-                        self.env.close()
-                    except Exception:
-                        print("Warning: could not close environment")
-                    finally:
-                        self.env = None
-
-            async def prepare_for_next_game(self):
-                await self.cleanup_environment()
-
-                if self.sandbox:
-                    print(f"Terminating sandbox {self.sandbox.object_id}")
-                    self.sandbox.terminate()
-                    self.sandbox = await create_sandbox()
-
-                self.game_running = False
-                self.game_state = create_initial_game_state()
-                self.observation = None
-                self.info = None
-                self.player1_next_buttons = []
-                self.player2_next_buttons = []
-                self.player1_recent_move_names = []
-                self.player2_recent_move_names = []
-                self.player1_current_action = 0
-                self.actions = {"agent_0": 0, "agent_1": 0}
-                self.in_transition = False
-                self.transition_start_time = None
-
-            async def cleanup(self):
-                print("Cleaning up resources...")
-                await self.cleanup_environment()
-                if self.sandbox:
-                    print(f"Terminating sandbox {self.sandbox.object_id}")
-                    self.sandbox.terminate()
-                    self.sandbox = None
-
         # routes
 
         @web_app.websocket("/ws")
@@ -361,14 +323,22 @@ class Web:
             await websocket.accept()
             print("Client connected")
 
-            session = GameSession(websocket)
-
-            _, _, session.sandbox = await asyncio.gather(
+            _, _, sandbox = await asyncio.gather(
                 self.create_llm(),
                 self.create_yolo(),
                 create_sandbox(),
             )
 
+            session = MatchEngine(
+                create_sandbox,
+                sandbox=sandbox,
+                llm=self.llm_client,
+                yolo=self.yolo_client,
+                detector_input_size=self.yolo_input_size,
+                send_frame=websocket.send_bytes,
+                tracer=create_tracer("session") if trace_sessions else None,
+            )
+
             async def process_inbound_messages():
                 try:
                     while not session.stop_event.is_set():
@@ -384,6 +354,14 @@ class Web:
                                 session.game_running = True
                         elif message_type == "player_action":
                             await session.handle_player_action(data["data"])
+                        elif message_type == "frame_metrics":
+                            self.frame_metrics.append(
+                                {
+                                    "time": time.time(),
+                                    "frames_sent": session.n_frames_sent,
+                                    **parse_frame_metrics(data.get("data")),
+                                }
+                            )
                         elif message_type == "gamepad_status":
                             session.game_settings["gamepadConnected"] = data.get(
                                 "data", {}
@@ -401,7 +379,7 @@ class Web:
                     while not session.stop_event.is_set():
                         message = await session.outbound_message_queue.get()
                         print(f"Sending game state: {message}")
-                        await websocket.send_json(message)
+                        await websocket.send_json(make_json_safe(message))
 
                 except WebSocketDisconnect:
                     print("WebSocket disconnected in outgoing processor")
@@ -412,150 +390,7 @@ class Web:
 
             async def run_robot_background():
                 try:
-                    while not session.stop_event.is_set():
-                        await asyncio.sleep(0.001)
-
-                        if (
-                            not session.game_running
-                            or session.observation is None
-                            or session.in_transition
-                        ):
-                            continue
-
-                        if (
-                            "timer" not in session.observation
-                            or session.observation["timer"] is None
-                        ):  # in case env was just reset
-                            continue
-
-                        # store values to avoid race condition
-                        # TODO: remove since condition above should be enough
-                        timer = session.observation["timer"][0]
-                        frame = session.observation["frame"]
-
-                        obs_p1 = session.observation["P1"]
-                        obs_p2 = session.observation["P2"]
-
-                        p1_settings = session.game_settings["player1"]
-                        p2_settings = session.game_settings["player2"]
-
-                        p1_character = p1_settings["character"]
-                        p2_character = p2_settings["character"]
-
-                        (
-                            boxes,
-                            class_ids,
-                        ) = await self.yolo.detect_characters.remote.aio(
-                            [
-                                CHARACTER_TO_ID[p1_character],
-                                CHARACTER_TO_ID[p2_character],
-                            ],
-                            frame,
-                        )
-
-                        game_info = GameInfo(
-                            timer=timer,
-                            boxes=boxes,
-                            class_ids=class_ids,
-                        )
-
-                        player1 = PlayerState(
-                            character=p1_character,
-                            super_art=p1_settings["superArt"],
-                            wins=obs_p1["wins"][0],
-                            side=obs_p1["side"],
-                            stunned=obs_p1["stunned"],
-                            stun_bar=obs_p1["stun_bar"][0],
-                            health=obs_p1["health"][0],
-                            super_count=obs_p1["super_count"][0],
-                            super_bar=obs_p1["super_bar"][0],
-                        )
-
-                        player2 = PlayerState(
-                            character=p2_character,
-                            super_art=p2_settings["superArt"],
-                            wins=obs_p2["wins"][0],
-                            side=obs_p2["side"],
-                            stunned=obs_p2["stunned"],
-                            stun_bar=obs_p2["stun_bar"][0],
-                            health=obs_p2["health"][0],
-                            super_count=obs_p2["super_count"][0],
-                            super_bar=obs_p2["super_bar"][0],
-                        )
-
-                        if not session.game_settings["humanVsLlm"]:
-                            messages_p1, available_moves_p1 = create_messages(
-                                game_info,
-                                player2,
-                                player1,
-                                session.prev_game_info,
-                                session.prev_player2_state,
-                                session.prev_player1_state,
-                                session.player1_recent_move_names,
-                                session.game_settings["difficulty"],
-                            )
-
-                            moves_p1, move_name_p1 = await self.llm.chat.remote.aio(
-                                messages_p1,
-                                p1_character,
-                                p1_settings["superArt"],
-                                obs_p1["super_count"][0],
-                                obs_p1["side"],
-                                available_moves_p1,
-                            )
-                            session.player1_next_buttons.extend(moves_p1)
-                            session.player1_recent_move_names.append(move_name_p1)
-
-                            if (
-                                len(session.player1_next_buttons)
-                                > session.next_buttons_limit
-                            ):
-                                session.player1_next_buttons.pop(0)
-
-                            if (
-                                len(session.player1_recent_move_names)
-                                > session.recent_move_limit
-                            ):
-                                session.player1_recent_move_names.pop(0)
-
-                        messages, available_moves = create_messages(
-                            game_info,
-                            player1,
-                            player2,
-                            session.prev_game_info,
-                            session.prev_player1_state,
-                            session.prev_player2_state,
-                            session.player2_recent_move_names,
-                            session.game_settings["difficulty"],
-                        )
-
-                        moves, move_name = await self.llm.chat.remote.aio(
-                            messages,
-                            p2_character,
-                            p2_settings["superArt"],
-                            obs_p2["super_count"][0],
-                            obs_p2["side"],
-                            available_moves,
-                        )
-                        session.player2_next_buttons.extend(moves)
-                        session.player2_recent_move_names.append(move_name)
-
-                        if (
-                            len(session.player2_next_buttons)
-                            > session.next_buttons_limit
-                        ):
-                            session.player2_next_buttons.pop(0)
-
-                        if (
-                            len(session.player2_recent_move_names)
-                            > session.recent_move_limit
-                        ):
-                            session.player2_recent_move_names.pop(0)
-
-                        session.prev_game_info = game_info
-                        session.prev_player1_state = player1
-                        session.prev_player2_state = player2
-
+                    await session.run_robot()
                 except WebSocketDisconnect:
                     print("WebSocket disconnected in robot background")
                     session.stop_event.set()
@@ -565,182 +400,7 @@ class Web:
 
             async def run_game_loop():
                 try:
-                    while not session.stop_event.is_set():
-                        if not session.game_running:
-                            await asyncio.sleep(0.001)
-                            continue
-
-                        print("Creating DIAMBRA environment...")
-                        p1_settings = session.game_settings["player1"]
-                        p2_settings = session.game_settings["player2"]
-
-                        disable_keyboard = not session.game_settings["humanVsLlm"]
-                        disable_joystick = not session.game_settings["gamepadConnected"]
-
-                        settings = EnvironmentSettingsMultiAgent(
-                            step_ratio=1,
-                            role=(Roles.P1, Roles.P2),
-                            disable_keyboard=disable_keyboard,
-                            disable_joystick=disable_joystick,
-                            render_mode="rgb_array",
-                            splash_screen=False,
-                            grpc_timeout=30,
-                            action_space=(SpaceTypes.DISCRETE, SpaceTypes.DISCRETE),
-                            characters=[
-                                p1_settings["character"],
-                                p2_settings["character"],
-                            ],
-                            outfits=[
-                                p1_settings["outfit"],
-                                p2_settings["outfit"],
-                            ],
-                            super_art=[
-                                p1_settings["superArt"],
-                                p2_settings["superArt"],
-                            ],
-                        )
-                        try:
-                            session.env = await asyncio.wait_for(
-                                asyncio.to_thread(arena.make, "sfiii3n", settings),
-                                timeout=30,
-                            )
-                        except Exception as e:
-                            print(f"Error creating DIAMBRA environment: {e}")
-                            session.game_state["status"] = "error"
-                            session.game_state["error"] = str(e)
-                            await session.send_game_state()
-                            await session.prepare_for_next_game()
-                            await session.send_game_state()
-                            continue
-                        print("DIAMBRA environment created successfully!")
-
-                        session.game_state["status"] = "running"
-                        await session.send_game_state()
-
-                        try:
-                            session.observation, session.info = session.env.reset()
-                        except Exception as e:
-                            print(f"Error during env.reset: {e}")
-                            session.game_state["status"] = "error"
-                            session.game_state["error"] = str(e)
-                            await session.send_game_state()
-                            await session.prepare_for_next_game()
-                            await session.send_game_state()
-                            continue
-
-                        # according to https://docs.diambra.ai/envs/games/
-                        # SF3 runs at 164 FPS natively, but we want 60 FPS output
-                        target_fps = 60.0
-                        frame_interval = 1.0 / target_fps
-                        next_frame_time = asyncio.get_event_loop().time()
-
-                        # game loop
-
-                        while session.game_running and not session.stop_event.is_set():
-                            current_time = asyncio.get_event_loop().time()
-                            sleep_time = next_frame_time - current_time
-                            if sleep_time > 0:
-                                await asyncio.sleep(sleep_time)
-                            else:
-                                await asyncio.sleep(0)
-                            next_frame_time += frame_interval
-
-                            if session.in_transition:
-                                elapsed = (
-                                    asyncio.get_event_loop().time()
-                                    - session.transition_start_time
-                                )
-                                if elapsed >= session.transition_duration:
-                                    session.in_transition = False
-                                    session.transition_start_time = None
-                            else:
-                                session.actions = {
-                                    "agent_0": session.player1_next_buttons.pop(0)
-                                    if session.player1_next_buttons
-                                    else (
-                                        session.player1_current_action
-                                        if session.game_settings["humanVsLlm"]
-                                        else 0
-                                    ),
-                                    "agent_1": session.player2_next_buttons.pop(0)
-                                    if session.player2_next_buttons
-                                    else 0,
-                                }
-
-                                try:
-                                    (
-                                        session.observation,
-                                        reward,
-                                        terminated,
-                                        truncated,
-                                        session.info,
-                                    ) = session.env.step(session.actions)
-                                except Exception as e:
-                                    print(f"Error during env.step: {e}")
-                                    session.game_state["status"] = "error"
-                                    session.game_state["error"] = str(e)
-                                    await session.send_game_state()
-                                    await session.prepare_for_next_game()
-                                    await session.send_game_state()
-                                    continue
-
-                                if session.info.get("game_done", False):
-                                    if terminated or truncated:
-                                        p1_wins = session.observation["P1"]["wins"][0]
-                                        p2_wins = session.observation["P2"]["wins"][0]
-                                        print(
-                                            f"Game finished - P1: {p1_wins}, P2: {p2_wins}"
-                                        )
-
-                                        if session.game_settings["humanVsLlm"]:
-                                            if p1_wins > p2_wins:
-                                                session.game_state["scores"][0] += 1
-                                                winner = "YOU"
-                                            elif p2_wins > p1_wins:
-                                                session.game_state["scores"][1] += 1
-                                                winner = "LLM"
-                                            else:
-                                                winner = "Draw"
-                                        else:
-                                            if p1_wins > p2_wins:
-                                                session.game_state["scores"][0] += 1
-                                                winner = "LLM 1"
-                                            elif p2_wins > p1_wins:
-                                                session.game_state["scores"][1] += 1
-                                                winner = "LLM 2"
-                                            else:
-                                                winner = "Draw"
-
-                                        session.game_state["status"] = "finished"
-                                        session.game_state["winner"] = winner
-                                        await session.send_game_state()
-
-                                        await session.prepare_for_next_game()
-                                        await session.send_game_state()
-                                        continue
-                                elif session.info.get("round_done", False):
-                                    session.in_transition = True
-                                    session.transition_start_time = (
-                                        asyncio.get_event_loop().time()
-                                    )
-                                    await session.outbound_message_queue.put(
-                                        {
-                                            "type": "transition",
-                                            "data": {"transition_type": "round"},
-                                        }
-                                    )
-
-                            if not session.in_transition:
-                                frame = session.observation.get("frame")
-                                if frame is not None:
-                                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                                    _, buffer = cv2.imencode(
-                                        ".jpg",
-                                        frame,
-                                        [cv2.IMWRITE_JPEG_QUALITY, 85],
-                                    )
-                                    await websocket.send_bytes(buffer.tobytes())
-
+                    await session.run_game_loop()
                 except WebSocketDisconnect:
                     print("WebSocket disconnected in game loop")
                     session.stop_event.set()
@@ -750,6 +410,13 @@ class Web:
 
             await session.send_game_state()
 
+            # samples both the game loop and robot, plus their to_thread workers
+            profiler = (
+                create_profiler(profiles_path, "session") if profile_enabled else None
+            )
+            if profiler is not None:
+                profiler.start()
+
             tasks = [
                 asyncio.create_task(process_inbound_messages()),
                 asyncio.create_task(process_outbound_messages()),
@@ -783,6 +450,8 @@ class Web:
                 await asyncio.gather(*tasks, return_exceptions=True)
             finally:
                 await session.cleanup()
+                await save_tracer(session.tracer)
+                await save_profiler(profiler, cache_volume)
 
         @web_app.get("/")
         async def index():
@@ -824,10 +493,297 @@ class Web:
         async def gameplay_sound(sound: str):
             return FileResponse(f"{remote_sounds_dir}/gameplay/{sound}.mp3")
 
+        @web_app.get("/api/metrics")
+        async def get_metrics():
+            reports = list(self.frame_metrics)
+            n_displayed = sum(report.get("n_displayed", 0) for report in reports)
+            n_dropped = sum(report.get("n_dropped", 0) for report in reports)
+            return {
+                "frame_metrics": {
+                    "n_reports": len(reports),
+                    "n_displayed": n_displayed,
+                    "n_dropped": n_dropped,
+                    "drop_rate": n_dropped / max(n_displayed + n_dropped, 1),
+                    "latest": reports[-frame_metrics_recent:],
+                }
+            }
+
         @web_app.get("/api/extra-moves")
         async def get_extra_moves():
-            return make_json_safe({"combos": COMBOS, "special_moves": SPECIAL_MOVES})
+            return Response(self.extra_moves_json, media_type="application/json")
 
         web_app.mount("/", StaticFiles(directory=remote_frontend_dir), name="static")
 
         return web_app
+
+
+# headless
+
+
+@app.function(
+    image=image,
+    region=region,
+    volumes={cache_path: cache_volume, yolo_cache_path: yolo_cache_volume},
+    cpu=4,  # enough for the cpu detector backend
+    timeout=2 * 60 * minutes,
+)
+async def run_headless_match(
+    mode: str = "llm",  # "llm" or "bot"
+    n_games: int = 1,
+    max_seconds: float = 10 * minutes,
+    character: str = "Ken",
+    super_art: int = 1,
+    difficulty: str = "expert",
+    use_yolo: bool = True,
+    event_triggered: bool = True,
+    trace: bool = False,  # write a perfetto trace of every decision to the cache volume
+    profile: bool = False,  # write a sampled flamegraph profile to the cache volume
+    encoding: str = yolo_encoding,  # detector rpc payload: raw, png or jpeg
+    detector: str = detector_backend,  # "remote" or "cpu"
+):
+    import asyncio
+    import time
+    import traceback
+
+    if mode not in ["llm", "bot"]:
+        raise ValueError(f"Unknown mode: {mode}")
+    if detector not in ["remote", "cpu"]:
+        raise ValueError(f"Unknown detector backend: {detector}")
+
+    async def create_llm():
+        if mode != "llm":
+            return None
+        llm = LLMServer()
+        await llm.boot.remote.aio()
+        return LLMClient(llm)
+
+    async def create_yolo():
+        if not use_yolo:
+            return None, None
+        if detector == "cpu":
+            client = await asyncio.to_thread(
+                LocalYOLOClient,
+                yolo_cpu_model_name,
+                cpu_detector_sessions,
+                cpu_detector_threads,
+            )
+            return client, client.input_size
+        yolo = YOLOServer()
+        await yolo.boot.remote.aio()
+        client = YOLOClient(yolo, max_batch_size=1)  # a single caller, as in Web
+        await client.negotiate(encoding)
+        return client, client.input_size
+
+    llm, (yolo, yolo_input_size), sandbox = await asyncio.gather(
+        create_llm(), create_yolo(), create_sandbox()
+    )
+
+    bytes_sent = 0
+
+    async def send_frame(data: bytes):
+        nonlocal bytes_sent
+        bytes_sent += len(data)
+
+    engine = MatchEngine(
+        create_sandbox,
+        sandbox=sandbox,
+        llm=llm,
+        yolo=yolo,
+        detector_input_size=yolo_input_size,
+        send_frame=send_frame,
+        target_fps=None,
+        transition_duration=0.0,
+        event_triggered=event_triggered,
+        tracer=create_tracer("headless") if trace else None,
+    )
+    player_settings = {"character": character, "outfit": 1, "superArt": super_art}
+    engine.game_settings.update(
+        {
+            "player1": dict(player_settings),
+            "player2": dict(player_settings),
+            "humanVsLlm": False,
+            "difficulty": difficulty,
+        }
+    )
+
+    start_time = None
+    start_frames = start_decisions = 0
+    winners = []
+
+    async def process_outbound_messages():
+        nonlocal start_time, start_frames, start_decisions
+        while not engine.stop_event.is_set():
+            message = await engine.outbound_message_queue.get()
+            print(f"Game state: {message}")
+            if message["type"] != "game_state":
+                continue
+            status = message["data"]["status"]
+            if status == "running" and start_time is None:
+                # exclude sandbox + env creation from throughput
+                start_time = time.perf_counter()
+                start_frames, start_decisions = engine.n_frames, engine.n_decisions
+            elif status == "finished":
+                winners.append(message["data"]["winner"])
+
+    async def run(fn, name: str):
+        try:
+            await fn()
+        except Exception:
+            print(f"Error in {name}: {traceback.format_exc()}")
+            engine.stop_event.set()
+
+    profiler = create_profiler(profiles_path, "headless") if profile else None
+    if profiler is not None:
+        profiler.start()
+
+    tasks = [
+        asyncio.create_task(process_outbound_messages()),
+        asyncio.create_task(run(engine.run_robot, "robot")),
+        asyncio.create_task(run(engine.run_game_loop, "game loop")),
+    ]
+
+    deadline = time.perf_counter() + max_seconds
+    try:
+        while (
+            engine.n_games < n_games
+            and not engine.stop_event.is_set()
+            and time.perf_counter() < deadline
+        ):
+            engine.game_running = True
+            await asyncio.sleep(0.1)
+    finally:
+        end_time = time.perf_counter()
+        engine.stop_event.set()
+        engine.game_running = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await engine.cleanup()
+        await save_tracer(engine.tracer)
+        await save_profiler(profiler, cache_volume)
+
+    elapsed = end_time - (start_time or end_time)
+    n_frames = engine.n_frames - start_frames
+    n_decisions = engine.n_decisions - start_decisions
+    return {
+        "mode": mode,
+        "n_games": engine.n_games,
+        "winners": winners,
+        "elapsed_s": elapsed,
+        "n_frames": n_frames,
+        "n_decisions": n_decisions,
+        "frames_per_s": n_frames / elapsed if elapsed > 0 else 0.0,
+        "decisions_per_s": n_decisions / elapsed if elapsed > 0 else 0.0,
+        "bytes_sent": bytes_sent,
+        "trigger_counts": engine.trigger.counts if engine.trigger else {},
+        "n_skipped_decisions": engine.trigger.n_skipped if engine.trigger else 0,
+        "decision_frames": engine.trigger.decision_frames if engine.trigger else None,
+        "trace_path": str(engine.tracer.path) if engine.tracer else None,
+        "profile_path": str(profiler.path) if profiler else None,
+    }
+
+
+@app.local_entrypoint()
+async def main(
+    mode: str = "llm",
+    n_games: int = 1,
+    max_seconds: int = 10 * minutes,
+    character: str = "Ken",
+    super_art: int = 1,
+    difficulty: str = "expert",
+    use_yolo: bool = True,
+    event_triggered: bool = True,
+    trace: bool = False,
+    profile: bool = False,
+    encoding: str = yolo_encoding,
+    detector: str = detector_backend,
+):
+    stats = await run_headless_match.remote.aio(
+        mode,
+        n_games,
+        max_seconds,
+        character,
+        super_art,
+        difficulty,
+        use_yolo,
+        event_triggered,
+        trace,
+        profile,
+        encoding,
+        detector,
+    )
+    print("--------------------------------")
+    print(f"Headless {stats['mode']} match ({stats['n_games']} games):")
+    print(f"  winners: {stats['winners']}")
+    print(f"  elapsed: {stats['elapsed_s']:.2f}s")
+    print(f"  frames: {stats['n_frames']} ({stats['frames_per_s']:.2f} frames/s)")
+    print(
+        f"  decisions: {stats['n_decisions']} ({stats['decisions_per_s']:.2f} decisions/s)"
+    )
+    print(f"  sent: {stats['bytes_sent'] / 1e6:.2f}MB")
+    if stats["trigger_counts"]:
+        print(f"  skipped decisions: {stats['n_skipped_decisions']}")
+        if stats["decision_frames"] is not None:
+            print(
+                f"  frames per decision: {stats['decision_frames']:.1f}"
+                " (the queue_low threshold in queued buttons)"
+            )
+        print("  decision triggers:")
+        for name, count in stats["trigger_counts"].items():
+            print(f"    {name}: {count}")
+    if stats["trace_path"]:
+        print(f"  trace: {stats['trace_path']} (sf3-web-cache volume)")
+    if stats["profile_path"]:
+        print(f"  profile: {stats['profile_path']} (sf3-web-cache volume)")
+    print("--------------------------------")
+
+
+# cold start
+
+
+@app.function(image=image, region=region, timeout=30 * minutes)
+async def measure_time_to_first_frame(url: str) -> dict:
+    import json
+    import time
+
+    from websockets.asyncio.client import connect
+
+    ws_url = url.replace("https://", "wss://").replace("http://", "ws://") + "/ws"
+
+    start = time.perf_counter()
+    timings = {}
+    async with connect(ws_url, max_size=None) as websocket:
+        timings["connect_s"] = time.perf_counter() - start
+
+        # the server creates the llm, yolo and sandbox before sending any state
+        json.loads(await websocket.recv())
+        timings["first_state_s"] = time.perf_counter() - start
+
+        await websocket.send(json.dumps({"type": "start_game", "data": {}}))
+        while not isinstance(await websocket.recv(), bytes):
+            pass
+        timings["first_frame_s"] = time.perf_counter() - start
+    return timings
+
+
+@app.local_entrypoint()
+async def cold_start():
+    # `modal run` creates fresh containers for every class, so this is a cold start
+    # web containers restore from a memory snapshot once one has been taken
+    url = Web().app.get_web_url()
+    print(f"Connecting to {url}...")
+    timings = await measure_time_to_first_frame.remote.aio(url)
+
+    reports = [
+        await Web().get_startup_report.remote.aio(),
+        await YOLOServer().get_startup_report.remote.aio(),
+        await LLMServer().get_startup_report.remote.aio(),
+    ]
+
+    print("--------------------------------")
+    print("Time to first frame:")
+    for name, s in timings.items():
+        print(f"  {name}: {s:.2f}s")
+    for report in reports:
+        print(format_report(report))
+    print("--------------------------------")
@@ -0,0 +1,452 @@
+import queue
+import time
+
+from .codec import decode_image
+from .utils import X_SIZE, Y_SIZE
+
+# in-process character detection over onnxruntime sessions
+# YOLOServer runs it on the gpu, LocalYOLOClient in gateway.py on the cpu
+
+
+class Detector:
+    def __init__(
+        self,
+        sessions: list,  # onnxruntime.InferenceSession, one per concurrent caller
+        input_name: str,
+        input_height: int,
+        input_width: int,
+        dynamic_batch: bool,
+        max_batch_size: int,
+    ):
+        self.input_name = input_name
+        self.input_height = input_height
+        self.input_width = input_width
+        self.max_batch_size = max_batch_size
+
+        # each session comes with its own preallocated, io-bound buffers
+        self.slots = queue.SimpleQueue()
+        for session in sessions:
+            self.slots.put(
+                InferenceSlot(
+                    session,
+                    input_name,
+                    max_batch_size if dynamic_batch else 1,
+                    max_batch_size,
+                    input_height,
+                    input_width,
+                )
+            )
+
+    def detect(
+        self,
+        character_ids: list[int],
+        frame=None,
+        confidence_threshold: float = 0.0,
+        use_dummy_frame: bool = False,
+        return_objects: bool = True,
+        input_img=None,  # uint8 HWC, already colour converted and maybe resized
+        frame_size: tuple[int, int] | None = None,  # (width, height) before resize
+        return_timings: bool = False,  # also return per-stage timings for benchmarks
+    ):
+        result = self.detect_batch(
+            [
+                {
+                    "character_ids": character_ids,
+                    "frame": frame,
+                    "confidence_threshold": confidence_threshold,
+                    "use_dummy_frame": use_dummy_frame,
+                    "return_objects": return_objects,
+                    "input_img": input_img,
+                    "frame_size": frame_size,
+                    "return_timings": return_timings,
+                }
+            ]
+        )[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def detect_batch(self, requests: list[dict]) -> list:
+        # one result per request, or the exception that request alone raised, so a
+        # bad payload doesn't fail everyone it was batched with
+        import numpy as np
+
+        if len(requests) > self.max_batch_size:  # more than the buffers hold
+            return self.detect_batch(
+                requests[: self.max_batch_size]
+            ) + self.detect_batch(requests[self.max_batch_size :])
+
+        results = [None] * len(requests)
+
+        # buffers are reused, so the slot stays checked out until results are copied out
+        slot = self.slots.get()  # blocks if every session is busy
+        try:
+            # prepare frames straight into the input buffer, rows of the ones that
+            # prepared are packed together
+
+            start = time.perf_counter()
+
+            prepared = []  # request index per buffer row
+            request_character_ids = []
+            img_sizes = []
+            for idx, request in enumerate(requests):
+                try:
+                    ids = np.asarray(request["character_ids"], dtype=np.int32)
+                    frame = decode_image(request.get("frame"))
+                    if request.get("use_dummy_frame", False):
+                        frame = np.random.randint(
+                            0, 256, (Y_SIZE, X_SIZE, 3), dtype=np.uint8
+                        )
+                    img_size = slot.buffers.prepare(
+                        len(prepared),
+                        frame,
+                        decode_image(request.get("input_img")),
+                        request.get("frame_size"),
+                    )
+                except Exception as e:
+                    results[idx] = e
+                    continue
+                prepared.append(idx)
+                request_character_ids.append(ids.reshape(-1))
+                img_sizes.append(img_size)
+            if not prepared:
+                return results
+            slot.buffers.to_tensor(len(prepared))
+            preprocessed = time.perf_counter()
+
+            # run inference
+
+            predictions = slot.run(len(prepared))
+            inferred = time.perf_counter()
+
+            # shorter character id lists are padded with -1, which never matches a class
+            n_characters = max(len(ids) for ids in request_character_ids)
+            character_ids = np.full((len(prepared), n_characters), -1, dtype=np.int32)
+            for row, ids in enumerate(request_character_ids):
+                character_ids[row, : len(ids)] = ids
+            confidence_thresholds = np.array(
+                [requests[idx].get("confidence_threshold", 0.0) for idx in prepared],
+                dtype=np.float32,
+            )
+
+            # postprocess all frames at once, each with its own geometry
+
+            boxes, class_ids = self.postprocess(
+                predictions, character_ids, confidence_thresholds, img_sizes
+            )
+            postprocessed = time.perf_counter()
+        finally:
+            self.slots.put(slot)
+
+        print(
+            f"Detected {np.sum(class_ids != -1)} characters in {len(prepared)} frames"
+        )
+
+        timings = {  # shared by the whole batch
+            "batch_size": len(prepared),
+            "preprocess_s": preprocessed - start,
+            "inference_s": inferred - preprocessed,
+            "postprocess_s": postprocessed - inferred,
+        }
+        for row, idx in enumerate(prepared):
+            request = requests[idx]
+            n = len(request["character_ids"])
+            if not request.get("return_objects", True):
+                results[idx] = None
+            elif request.get("return_timings"):
+                results[idx] = (boxes[row, :n], class_ids[row, :n], dict(timings))
+            else:
+                results[idx] = (boxes[row, :n], class_ids[row, :n])
+        return results
+
+    def postprocess(
+        self,
+        predictions,  # (batch, n_detections, 6): xmin, ymin, xmax, ymax, score, class
+        character_ids,  # (batch, n_characters)
+        confidence_thresholds,  # (batch,)
+        img_sizes: list[tuple[int, int]],  # (width, height) per frame
+    ):
+        import numpy as np
+
+        # best box per requested character for every frame at once, a character
+        # requested twice (mirror matches) gets its best and second best box
+        # returns float32 (batch, n_characters, 4) boxes and int32 (batch, n_characters)
+        # class ids, with a zero box and -1 where a character wasn't detected
+
+        batch_size, n_characters = character_ids.shape
+        if predictions.shape[1] == 0:
+            return (
+                np.zeros((batch_size, n_characters, 4), dtype=np.float32),
+                np.full((batch_size, n_characters), -1, dtype=np.int32),
+            )
+
+        ## match detections to characters: (batch, n_characters, n_detections)
+
+        scores = predictions[:, :, 4].astype(np.float32)
+        matches = (
+            predictions[:, None, :, 5].astype(np.int32) == character_ids[:, :, None]
+        )
+        matches &= (scores >= confidence_thresholds[:, None])[:, None, :]
+        # how many times each id was already requested earlier in its row
+        repeats = character_ids[:, :, None] == character_ids[:, None, :]
+        rank = np.tril(repeats, -1).sum(axis=2)
+        found = matches.sum(axis=2) > rank
+        order = np.argsort(-np.where(matches, scores[:, None, :], -np.inf), axis=2)
+        best = np.take_along_axis(
+            order, np.minimum(rank, order.shape[2] - 1)[:, :, None], axis=2
+        )[:, :, 0]
+
+        boxes = np.take_along_axis(
+            predictions[:, :, :4], best[:, :, None], axis=1
+        ).astype(np.float32)
+        boxes[~found] = 0
+        class_ids = np.where(found, character_ids, -1).astype(np.int32)
+
+        ## resize boxes to original frame size
+
+        limits = np.tile(np.array(img_sizes, dtype=np.float32), 2)[:, None, :]
+        input_shape = np.array(
+            [
+                self.input_width,
+                self.input_height,
+                self.input_width,
+                self.input_height,
+            ],
+            dtype=np.float32,
+        )
+        boxes *= limits / input_shape
+        np.clip(boxes, 0, limits, out=boxes)
+
+        return boxes, class_ids
+
+
+class FrameBuffers:
+    # preallocated model inputs for up to batch_size frames
+    def __init__(
+        self,
+        batch_size: int,
+        input_height: int,
+        input_width: int,
+        dtype=None,  # of the model input, defaults to float16
+    ):
+        import numpy as np
+
+        self.images = np.empty(
+            (batch_size, input_height, input_width, 3), dtype=np.uint8
+        )
+        self.tensor = np.empty(
+            (batch_size, 3, input_height, input_width), dtype=dtype or np.float16
+        )
+
+    def prepare(
+        self,
+        idx: int,
+        frame=None,  # raw observation
+        input_img=None,  # uint8 HWC, already colour converted and maybe resized
+        frame_size: tuple[int, int] | None = None,  # (width, height) before resize
+    ) -> tuple[int, int]:
+        import cv2
+        import numpy as np
+
+        dst = self.images[idx]
+        input_height, input_width = dst.shape[:2]
+
+        if input_img is None:
+            img_height, img_width = frame.shape[:2]
+            src = frame
+        elif frame_size is not None:
+            img_width, img_height = frame_size
+            src = input_img
+        else:
+            img_height, img_width = input_img.shape[:2]
+            src = input_img
+
+        if src.shape[:2] != (input_height, input_width):
+            cv2.resize(src, (input_width, input_height), dst=dst)
+            if input_img is None:  # swapping channels commutes with resizing
+                cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+        elif input_img is None:  # native-size export, one pass straight into the buffer
+            cv2.cvtColor(src, cv2.COLOR_BGR2RGB, dst=dst)
+        else:
+            np.copyto(dst, src)
+
+        return img_width, img_height
+
+    def to_tensor(self, n: int):
+        import numpy as np
+
+        # uint8 NHWC -> float NCHW / 255 in one pass, no float64 or full-size temporaries
+        np.multiply(
+            self.images[:n].transpose(0, 3, 1, 2),
+            np.float32(1 / 255.0),
+            out=self.tensor[:n],
+            dtype=np.float32,
+            casting="unsafe",
+        )
+        return self.tensor[:n]
+
+
+class InferenceSlot:
+    # a session and its buffers, used by one inference thread at a time
+    def __init__(
+        self,
+        session,
+        input_name: str,
+        run_size: int,  # frames per session run, 1 for static-batch exports
+        max_batch_size: int,
+        input_height: int,
+        input_width: int,
+    ):
+        import numpy as np
+
+        self.session = session
+        self.input_name = input_name
+        self.run_size = run_size
+        self.buffers = FrameBuffers(
+            max_batch_size,
+            input_height,
+            input_width,
+            to_dtype(session.get_inputs()[0].type),
+        )
+
+        # inputs and outputs are bound to host buffers, so runs don't allocate
+        self.binding = session.io_binding()
+        model_output = session.get_outputs()[0]
+        self.output_name = model_output.name
+        self.outputs = None  # let onnxruntime allocate if the shape isn't static
+        if all(isinstance(dim, int) for dim in model_output.shape[1:]):
+            self.outputs = np.empty(
+                (max_batch_size, *model_output.shape[1:]),
+                dtype=to_dtype(model_output.type),
+            )
+
+    def run(self, n: int):
+        import numpy as np
+
+        # returns a view into the output buffer, only valid until the next run
+        allocated = []
+        for start in range(0, n, self.run_size):
+            end = min(start + self.run_size, n)
+            tensor = self.buffers.tensor[start:end]
+            self.binding.bind_input(
+                self.input_name,
+                "cpu",
+                0,
+                tensor.dtype,
+                tensor.shape,
+                tensor.ctypes.data,
+            )
+            if self.outputs is not None:
+                outputs = self.outputs[start:end]
+                self.binding.bind_output(
+                    self.output_name,
+                    "cpu",
+                    0,
+                    outputs.dtype,
+                    outputs.shape,
+                    outputs.ctypes.data,
+                )
+            else:
+                self.binding.bind_output(self.output_name, "cpu")
+
+            self.session.run_with_iobinding(self.binding)
+            if self.outputs is None:
+                allocated.append(self.binding.copy_outputs_to_cpu()[0])
+
+        if self.outputs is not None:
+            return self.outputs[:n]
+        return np.concatenate(allocated)
+
+
+def read_input_spec(model) -> tuple[str, int, int, bool]:
+    # (input name, height, width, dynamic batch) without creating a session
+    import ast
+
+    model_input = model.graph.input[0]
+    dims = [
+        dim.dim_param or dim.dim_value for dim in model_input.type.tensor_type.shape.dim
+    ]
+    dynamic_batch = isinstance(dims[0], str)
+
+    height, width = dims[2], dims[3]
+    if isinstance(height, str) or isinstance(width, str):
+        # dynamic exports also free the spatial dims, ultralytics records the trained size
+        metadata = {prop.key: prop.value for prop in model.metadata_props}
+        height, width = ast.literal_eval(metadata["imgsz"])
+    return model_input.name, height, width, dynamic_batch
+
+
+def load_model(model_path, float32: bool = False):
+    import onnx
+
+    model = onnx.load(str(model_path))
+    if float32:
+        to_float32(model)
+    return model
+
+
+def to_float32(model):
+    # the export is fp16 for the gpu, but the cpu provider lacks most fp16 kernels
+    import numpy as np
+    from onnx import AttributeProto, TensorProto, numpy_helper
+
+    def convert_tensor(tensor):
+        if tensor.data_type == TensorProto.FLOAT16:
+            array = numpy_helper.to_array(tensor).astype(np.float32)
+            tensor.CopyFrom(numpy_helper.from_array(array, tensor.name))
+
+    for initializer in model.graph.initializer:
+        convert_tensor(initializer)
+    for value in [*model.graph.input, *model.graph.output, *model.graph.value_info]:
+        tensor_type = value.type.tensor_type
+        if tensor_type.elem_type == TensorProto.FLOAT16:
+            tensor_type.elem_type = TensorProto.FLOAT
+    for node in model.graph.node:
+        for attribute in node.attribute:
+            if attribute.type == AttributeProto.TENSOR:  # Constant
+                convert_tensor(attribute.t)
+            elif (
+                node.op_type == "Cast"
+                and attribute.name == "to"
+                and attribute.i == TensorProto.FLOAT16
+            ):
+                attribute.i = TensorProto.FLOAT
+    return model
+
+
+def to_dtype(onnx_type: str):
+    import numpy as np
+
+    return np.float16 if onnx_type == "tensor(float16)" else np.float32
+
+
+def create_cpu_detector(
+    model_path,
+    n_sessions: int = 1,
+    n_threads: int = 2,  # per session
+    max_batch_size: int = 8,
+) -> Detector:
+    import onnxruntime
+
+    model = load_model(model_path, float32=True)
+    input_name, input_height, input_width, dynamic_batch = read_input_spec(model)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = n_threads
+    model_bytes = model.SerializeToString()
+    sessions = [
+        onnxruntime.InferenceSession(
+            model_bytes,
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        for _ in range(n_sessions)
+    ]
+    return Detector(
+        sessions,
+        input_name,
+        input_height,
+        input_width,
+        dynamic_batch,
+        max_batch_size,
+    )
@@ -9,22 +9,18 @@ import { UIController } from "./uiController.js";
 import { GamepadManager } from "./gamepadManager.js";
 import { GamepadUINavigator } from "./gamepadUINavigator.js";
 import { WebSocketManager } from "./webSocketManager.js";
+import { FrameRenderer } from "./frameRenderer.js";
 import { byId } from "./utils.js";
 
 export const setCanvasSize = () => {
   const isMobile = /iPhone|iPad|iPod|Android/i.test(navigator.userAgent);
-  const canvas = byId("game-canvas");
-  if (canvas) {
-    // original = 384x224
-    if (isMobile) {
-      // 1.5x scale for mobile
-      canvas.width = 576;
-      canvas.height = 336;
-    } else {
-      // 2x scale for desktop
-      canvas.width = 768;
-      canvas.height = 448;
-    }
+  // original = 384x224
+  if (isMobile) {
+    // 1.5x scale for mobile
+    FrameRenderer.resize(576, 336);
+  } else {
+    // 2x scale for desktop
+    FrameRenderer.resize(768, 448);
   }
 };
 
@@ -0,0 +1,75 @@
+import { byId } from "./utils.js";
+import { createFrameSink } from "./frameSink.js";
+
+// binary frames are a 12 byte header (uint32 sequence number, float64 server
+// unix time in ms, little endian) followed by the jpeg, see frame_header in match.py
+const HEADER_BYTES = 12;
+
+export const FrameRenderer = {
+  worker: null,
+  sink: null, // main thread fallback
+  onMetrics: null,
+
+  init(callbacks = {}) {
+    this.onMetrics = callbacks.onMetrics || (() => {});
+
+    const canvas = byId("game-canvas");
+    if (!canvas) return;
+
+    if (
+      typeof Worker === "function" &&
+      typeof canvas.transferControlToOffscreen === "function"
+    ) {
+      const offscreen = canvas.transferControlToOffscreen();
+      this.worker = new Worker(new URL("./frameWorker.js", import.meta.url), {
+        type: "module",
+      });
+      this.worker.onmessage = (event) => {
+        if (event.data.type === "metrics") this.onMetrics(event.data.data);
+      };
+      this.worker.postMessage({ type: "init", canvas: offscreen }, [offscreen]);
+    } else {
+      this.sink = createFrameSink(canvas, (metrics) => this.onMetrics(metrics));
+    }
+  },
+
+  render(buffer) {
+    const receivedAt = performance.timeOrigin + performance.now();
+    const header = new DataView(buffer, 0, HEADER_BYTES);
+    const frame = {
+      seq: header.getUint32(0, true),
+      serverTime: header.getFloat64(4, true),
+      receivedAt,
+      jpeg: new Uint8Array(buffer, HEADER_BYTES),
+    };
+
+    if (this.worker) {
+      this.worker.postMessage({ type: "frame", data: frame }, [buffer]);
+    } else if (this.sink) {
+      this.sink.push(frame);
+    }
+  },
+
+  // once transferred, the canvas can only be resized and cleared by its owner
+  resize(width, height) {
+    if (this.worker) {
+      this.worker.postMessage({ type: "resize", width, height });
+    } else if (this.sink) {
+      this.sink.resize(width, height);
+    } else {
+      const canvas = byId("game-canvas");
+      if (canvas) {
+        canvas.width = width;
+        canvas.height = height;
+      }
+    }
+  },
+
+  clear() {
+    if (this.worker) {
+      this.worker.postMessage({ type: "clear" });
+    } else if (this.sink) {
+      this.sink.clear();
+    }
+  },
+};
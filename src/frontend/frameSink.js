@@ -0,0 +1,131 @@
+// decodes jpeg frames and draws the newest one each display refresh
+// runs in frameWorker.js, or on the main thread where OffscreenCanvas isn't supported
+
+const METRICS_INTERVAL_MS = 1000;
+
+const now = () => performance.timeOrigin + performance.now(); // comparable across threads
+
+const percentile = (values, p) => {
+  if (values.length === 0) return null;
+  const sorted = [...values].sort((a, b) => a - b);
+  const idx = Math.min(
+    Math.max(Math.ceil((sorted.length * p) / 100) - 1, 0),
+    sorted.length - 1
+  );
+  return sorted[idx];
+};
+
+const summarize = (values) => ({
+  p50: percentile(values, 50),
+  p90: percentile(values, 90),
+  p99: percentile(values, 99),
+});
+
+export const createFrameSink = (canvas, onMetrics) => {
+  const ctx = canvas.getContext("2d");
+  const requestFrame =
+    typeof requestAnimationFrame === "function"
+      ? requestAnimationFrame
+      : (fn) => setTimeout(fn, 0);
+
+  let latestSeq = -1; // newest frame decoded so far
+  let pending = null; // decoded but not yet drawn
+  let drawScheduled = false;
+
+  let stats = null;
+  const resetStats = () => {
+    stats = {
+      start: now(),
+      received: 0,
+      displayed: 0,
+      dropped: 0,
+      decodeMs: [],
+      displayMs: [], // websocket receive -> drawn
+      e2eMs: [], // server send -> drawn, includes clock skew
+    };
+  };
+  resetStats();
+
+  const drop = (frame) => {
+    frame.bitmap.close();
+    stats.dropped += 1;
+  };
+
+  const draw = () => {
+    drawScheduled = false;
+    if (!pending) return;
+
+    const frame = pending;
+    pending = null;
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.drawImage(frame.bitmap, 0, 0, canvas.width, canvas.height);
+    frame.bitmap.close();
+
+    const drawnAt = now();
+    stats.displayed += 1;
+    stats.decodeMs.push(frame.decodeMs);
+    stats.displayMs.push(drawnAt - frame.receivedAt);
+    stats.e2eMs.push(drawnAt - frame.serverTime);
+
+    if (drawnAt - stats.start >= METRICS_INTERVAL_MS) {
+      onMetrics({
+        seq: frame.seq,
+        n_received: stats.received,
+        n_displayed: stats.displayed,
+        n_dropped: stats.dropped,
+        decode_ms: summarize(stats.decodeMs),
+        display_ms: summarize(stats.displayMs),
+        e2e_ms: summarize(stats.e2eMs),
+      });
+      resetStats();
+    }
+  };
+
+  const push = async ({ seq, serverTime, receivedAt, jpeg }) => {
+    stats.received += 1;
+    if (seq <= latestSeq) {
+      stats.dropped += 1; // arrived after a newer frame
+      return;
+    }
+
+    const decodeStart = now();
+    const bitmap = await createImageBitmap(
+      new Blob([jpeg], { type: "image/jpeg" })
+    );
+    const frame = {
+      seq,
+      serverTime,
+      receivedAt,
+      bitmap,
+      decodeMs: now() - decodeStart,
+    };
+
+    if (seq <= latestSeq) {
+      drop(frame); // a newer frame finished decoding first
+      return;
+    }
+    latestSeq = seq;
+
+    if (pending) drop(pending); // never displayed, superseded before the next refresh
+    pending = frame;
+    if (!drawScheduled) {
+      drawScheduled = true;
+      requestFrame(draw);
+    }
+  };
+
+  const resize = (width, height) => {
+    canvas.width = width;
+    canvas.height = height;
+  };
+
+  const clear = () => {
+    if (pending) {
+      pending.bitmap.close();
+      pending = null;
+    }
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+  };
+
+  return { push, resize, clear };
+};
@@ -0,0 +1,26 @@
+import { createFrameSink } from "./frameSink.js";
+
+let sink = null;
+
+self.onmessage = (event) => {
+  const message = event.data;
+  switch (message.type) {
+    case "init":
+      sink = createFrameSink(message.canvas, (metrics) =>
+        self.postMessage({ type: "metrics", data: metrics })
+      );
+      break;
+
+    case "frame":
+      sink?.push(message.data);
+      break;
+
+    case "resize":
+      sink?.resize(message.width, message.height);
+      break;
+
+    case "clear":
+      sink?.clear();
+      break;
+  }
+};
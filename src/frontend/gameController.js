@@ -4,6 +4,7 @@ import { ScreenManager } from "./screenManager.js";
 import { WebSocketManager } from "./webSocketManager.js";
 import { AudioManager } from "./audioManager.js";
 import { GamepadManager } from "./gamepadManager.js";
+import { FrameRenderer } from "./frameRenderer.js";
 import { SOUND_KEYS } from "./constants.js";
 import { setCanvasSize } from "./app.js";
 
@@ -59,15 +60,12 @@ const createGameController = () => {
     if (overlay) overlay.classList.remove("hidden");
 
     const canvas = byId("game-canvas");
-    if (canvas) {
-      canvas.classList.add("hidden");
-      const ctx = canvas.getContext("2d");
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-    }
+    if (canvas) canvas.classList.add("hidden");
+    FrameRenderer.clear();
   };
 
   const handleWebSocketMessage = async (event) => {
-    if (event.data instanceof Blob) {
+    if (event.data instanceof ArrayBuffer) {
       handleFrameData(event.data);
       return;
     }
@@ -80,7 +78,7 @@ const createGameController = () => {
     }
   };
 
-  const handleFrameData = (blob) => {
+  const handleFrameData = (buffer) => {
     const state = GameState.get();
     const overlay = byId("canvas-loading-overlay");
 
@@ -95,23 +93,8 @@ const createGameController = () => {
       ScreenManager.checkTransitionReady();
     }
 
-    renderFrame(blob);
-  };
-
-  const renderFrame = (blob) => {
-    const canvas = byId("game-canvas");
-    if (!canvas) return;
-
-    const ctx = canvas.getContext("2d");
-    const url = URL.createObjectURL(blob);
-    const img = new Image();
-
-    img.onload = () => {
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
-      URL.revokeObjectURL(url);
-    };
-    img.src = url;
+    // decoded and drawn off the main thread, see frameWorker.js
+    FrameRenderer.render(buffer);
   };
 
   const handleGameState = (data) => {
@@ -178,6 +161,10 @@ const createGameController = () => {
   };
 
   const init = () => {
+    FrameRenderer.init({
+      onMetrics: (metrics) => WebSocketManager.send("frame_metrics", metrics),
+    });
+
     WebSocketManager.init({
       onMessage: handleWebSocketMessage,
     });
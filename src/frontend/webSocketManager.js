@@ -11,6 +11,7 @@ export const WebSocketManager = {
     const wsUrl = `${protocol}//${window.location.host}/ws`;
 
     this.socket = new WebSocket(wsUrl);
+    this.socket.binaryType = "arraybuffer"; // transferred to the frame worker
     const startButton = byId("start-game-btn");
 
     this.socket.onopen = () => console.log("Connected to server");
@@ -0,0 +1,241 @@
+import asyncio
+
+from .codec import encode_image
+
+# per-container clients for the yolo and llm servers, or an in-process cpu detector
+# concurrent calls from several callers can be coalesced into one batched rpc
+
+window_ms = 2.0  # how long the first request in a batch waits for others
+yolo_max_batch_size = 32
+# LLMServer's engine batches concurrent chat calls itself, and a direct call can be
+# cancelled on its own, so llm calls aren't coalesced into chat_batch by default
+llm_max_batch_size = 1
+
+
+def fail(future: asyncio.Future, error: BaseException):
+    if future.done():  # caller may have given up
+        return
+    if isinstance(error, asyncio.CancelledError):
+        future.cancel()
+    else:
+        future.set_exception(error)
+
+
+class Coalescer:
+    def __init__(
+        self,
+        call_batch,  # async fn taking a list of requests, returning a list of results
+        window_ms: float = window_ms,
+        max_batch_size: int = 32,
+    ):
+        self.call_batch = call_batch
+        self.window_s = window_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self.pending = []  # (request, future)
+        self.timer = None
+        self.tasks = set()  # keep references so batches aren't garbage collected
+
+        self.n_requests = 0
+        self.n_batches = 0
+
+    async def submit(self, request):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        self.n_requests += 1
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window_s, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch = self.pending[: self.max_batch_size]
+        self.pending = self.pending[self.max_batch_size :]
+        if self.pending:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.window_s, self.flush
+            )
+
+        batch = [(request, future) for request, future in batch if not future.done()]
+        if not batch:
+            return
+
+        self.n_batches += 1
+        task = asyncio.create_task(self.run_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, batch):
+        try:
+            results = await self.call_batch([request for request, _ in batch])
+        except BaseException as e:  # cancelled too, callers mustn't wait forever
+            for _, future in batch:
+                fail(future, e)
+            raise
+
+        if len(results) != len(batch):
+            error = RuntimeError(
+                f"Batch returned {len(results)} results for {len(batch)} requests"
+            )
+            for _, future in batch:
+                fail(future, error)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, BaseException):  # failed alone, see detect_batch
+                fail(future, result)
+            elif not future.done():  # caller may have given up
+                future.set_result(result)
+
+    def get_stats(self) -> dict:
+        return {
+            "n_requests": self.n_requests,
+            "n_batches": self.n_batches,
+            "avg_batch_size": self.n_requests / max(self.n_batches, 1),
+        }
+
+
+class YOLOClient:
+    def __init__(
+        self,
+        yolo,  # YOLOServer
+        window_ms: float = window_ms,
+        max_batch_size: int = yolo_max_batch_size,
+    ):
+        self.yolo = yolo
+        self.coalescer = None
+        if max_batch_size > 1:
+            self.coalescer = Coalescer(
+                yolo.detect_characters_batch.remote.aio, window_ms, max_batch_size
+            )
+
+        # set by negotiate
+        self.input_size = None  # (width, height) the model runs at
+        self.encoding = "raw"
+
+    async def negotiate(self, encoding: str = "raw") -> str:
+        spec = await self.yolo.get_input_spec.remote.aio()
+        self.input_size = tuple(spec["input_size"])
+        self.encoding = encoding if encoding in spec["encodings"] else "raw"
+        return self.encoding
+
+    def prepare(self, kwargs: dict) -> dict:
+        # shrink full frames to the model input and encode the image payload
+        frame = kwargs.get("frame")
+        if frame is not None and self.input_size is not None:
+            width, height = self.input_size
+            frame_height, frame_width = frame.shape[:2]
+            if width * height < frame_width * frame_height:
+                import cv2
+
+                input_img = cv2.resize(
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), (width, height)
+                )
+                kwargs = {
+                    **kwargs,
+                    "frame": None,
+                    "input_img": input_img,
+                    "frame_size": (frame_width, frame_height),
+                }
+
+        if self.encoding == "raw":
+            return kwargs
+        return {
+            key: encode_image(value, self.encoding)
+            if key in ["frame", "input_img"] and value is not None
+            else value
+            for key, value in kwargs.items()
+        }
+
+    async def detect_characters(self, character_ids: list[int], **kwargs):
+        kwargs = self.prepare(kwargs)
+        if self.coalescer is None:
+            return await self.yolo.detect_characters.remote.aio(character_ids, **kwargs)
+        return await self.coalescer.submit({"character_ids": character_ids, **kwargs})
+
+
+class LocalYOLOClient:
+    # same interface as YOLOClient, but runs the detector in-process on the cpu
+    def __init__(
+        self,
+        model_path,  # the best.onnx YOLOServer loads
+        n_sessions: int = 1,  # concurrent detections
+        n_threads: int = 2,  # per detection
+    ):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from .detector import create_cpu_detector
+
+        self.detector = create_cpu_detector(model_path, n_sessions, n_threads)
+        self.executor = ThreadPoolExecutor(
+            max_workers=n_sessions, thread_name_prefix="detector"
+        )
+        self.coalescer = None
+        self.input_size = (self.detector.input_width, self.detector.input_height)
+        self.encoding = "raw"
+
+    async def negotiate(self, encoding: str = "raw") -> str:
+        return self.encoding  # nothing goes over the wire
+
+    async def detect_characters(self, character_ids: list[int], **kwargs):
+        # off the event loop, onnxruntime releases the gil while it runs
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            lambda: self.detector.detect(character_ids, **kwargs),
+        )
+
+
+class LLMClient:
+    def __init__(
+        self,
+        llm,  # LLMServer
+        window_ms: float = window_ms,
+        max_batch_size: int = llm_max_batch_size,
+    ):
+        self.llm = llm
+        self.coalescer = None
+        if max_batch_size > 1:
+            self.coalescer = Coalescer(
+                llm.chat_batch.remote.aio, window_ms, max_batch_size
+            )
+
+    async def chat(
+        self,
+        messages: list[dict[str, str]],
+        character: str,
+        super_art: int,
+        super_count: int,
+        side: int,
+        available_moves: list[str] | None = None,
+        return_timings: bool = False,
+    ) -> tuple[list[int], str] | tuple[list[int], str, dict]:  # timings last if asked
+        if self.coalescer is None:
+            return await self.llm.chat.remote.aio(
+                messages,
+                character,
+                super_art,
+                super_count,
+                side,
+                available_moves,
+                return_timings,
+            )
+        return await self.coalescer.submit(
+            {
+                "messages": messages,
+                "character": character,
+                "super_art": super_art,
+                "super_count": super_count,
+                "side": side,
+                "available_moves": available_moves,
+                "return_timings": return_timings,
+            }
+        )
@@ -1,13 +1,22 @@
+import asyncio
+import copy
+import functools
 import time
+import uuid
 from pathlib import Path
 
 import modal
 
+from .startup import StartupProfiler, profile_imports
 from .utils import (
+    CHARACTER_MAPPING,
+    CLOSE_IN_MOVES,
     create_random_messages,
     get_available_instructions_for_character,
     minutes,
     parse_move,
+    prompt_layouts,
+    seed,
 )
 
 # Modal setup
@@ -51,6 +60,42 @@ model_name = (
 )  # pretrained hf model or cache_path/<project_name>/<run_name>/checkpoint-<max_steps>
 max_inputs = max_num_seqs = 8
 gpu = "b200"
+# distinct move sets, few per (character, super art, super count, difficulty,
+# recent-move filter), see get_guided_decoding
+move_set_cache_size = 1024
+
+
+@functools.lru_cache(maxsize=move_set_cache_size)
+def get_guided_decoding(choices: tuple[str, ...]):
+    # one per move set sent to this container's engine, which compiles a grammar from
+    # it before the first token and caches that by its text. sorted, so a set is always
+    # the same text, and a miss here is a compile in the engine, see respond
+    from vllm.sampling_params import GuidedDecodingParams
+
+    return GuidedDecodingParams(choice=list(choices))
+
+
+def get_base_move_sets() -> list[tuple[str, ...]]:
+    # every move set before the recent-move filter, see create_messages, compiled at
+    # startup so most requests skip the compile
+    return sorted(
+        {
+            tuple(
+                sorted(
+                    set(
+                        get_available_instructions_for_character(
+                            character, super_art, super_count, difficulty
+                        )
+                    )
+                )
+            )
+            for character in CHARACTER_MAPPING.values()
+            for super_art in range(1, 4)
+            for super_count in range(4)
+            for difficulty in ["basic", "advanced", "expert"]
+        }
+        | {tuple(sorted(CLOSE_IN_MOVES))}
+    )
 
 
 @app.cls(
@@ -72,23 +117,35 @@ class LLMServer:
 
     @modal.enter()
     async def enter(self):
-        from vllm import LLM, SamplingParams
+        self.startup_profiler = StartupProfiler("LLMServer")
+        with self.startup_profiler.step("import vllm"):
+            from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
 
-        cache_volume.reload()
+        with self.startup_profiler.step("cache_volume.reload"):
+            cache_volume.reload()
 
         load_path = self.ckpt_path or model_name
         print(f"Loading model from {load_path}")
 
-        self.llm = LLM(
-            model=str(load_path),
-            max_num_seqs=max_num_seqs,
-            max_num_batched_tokens=40960,  # https://qwen.readthedocs.io/en/latest/deployment/vllm.html#faq, https://docs.vllm.ai/en/latest/configuration/optimization.html#performance-tuning-with-chunked-prefill
-            enforce_eager=True,
-            swap_space=0,
-            enable_prefix_caching=True,  # https://docs.vllm.ai/en/stable/features/automatic_prefix_caching.html#example-workloads,
-            gpu_memory_utilization=0.9,
-            disable_log_stats=True,  # reduce overhead
-        )
+        # continuous batching: concurrent chat calls join the running batch
+        # between decode steps instead of waiting for each other
+        with self.startup_profiler.step("AsyncLLMEngine"):
+            self.engine = AsyncLLMEngine.from_engine_args(
+                AsyncEngineArgs(
+                    model=str(load_path),
+                    max_num_seqs=max_num_seqs,
+                    max_num_batched_tokens=40960,  # https://qwen.readthedocs.io/en/latest/deployment/vllm.html#faq, https://docs.vllm.ai/en/latest/configuration/optimization.html#performance-tuning-with-chunked-prefill
+                    enforce_eager=True,
+                    swap_space=0,
+                    enable_prefix_caching=True,  # https://docs.vllm.ai/en/stable/features/automatic_prefix_caching.html#example-workloads,
+                    gpu_memory_utilization=0.9,
+                    disable_log_stats=True,  # reduce overhead
+                    disable_log_requests=True,
+                )
+            )
+            self.tokenizer = await self.engine.get_tokenizer()
+        self.chat_template = Path(remote_chat_template_path).read_text()
+        self.reset_stats()
 
         self.sampling_params = SamplingParams(
             temperature=0.7,
@@ -103,60 +160,217 @@ class LLMServer:
 
         messages, _, _, _, _, _ = create_random_messages()
 
-        _ = self.llm.chat(
-            [messages],
-            self.sampling_params,
-            chat_template=remote_chat_template_path,
-        )
+        with self.startup_profiler.step("warmup"):
+            _ = await self.generate(messages, self.sampling_params)
+
+        # requests use guided decoding, whose backend is initialized on first use
+        with self.startup_profiler.step("warmup (guided decoding)"):
+            messages, character, super_art, super_count, _, available_moves = (
+                create_random_messages()
+            )
+            sampling_params, _ = self.create_sampling_params(
+                character, super_art, super_count, available_moves
+            )
+            _ = await self.generate(messages, sampling_params)
+
+        with self.startup_profiler.step("warmup (grammars)"):
+
+            async def compile_grammar(choices: tuple[str, ...]):
+                sampling_params = self.sampling_params.clone()
+                sampling_params.max_tokens = 1  # compiled before the first token
+                sampling_params.guided_decoding = copy.copy(
+                    get_guided_decoding(choices)
+                )
+                _ = await self.generate(messages, sampling_params)
+
+            await asyncio.gather(
+                *[compile_grammar(choices) for choices in get_base_move_sets()]
+            )
+
+        self.startup_profiler.print_report()
+        # warmup doesn't count
+        self.reset_stats()
 
     @modal.method()
     async def boot(self):  # so don't have to call `chat` to boot
         pass
 
     @modal.method()
-    async def chat(
+    async def get_startup_report(self) -> dict:
+        return {
+            **self.startup_profiler.get_report(),
+            "imports": profile_imports(["vllm"]),
+        }
+
+    def reset_stats(self):
+        self.stats = {
+            "n_requests": 0,
+            "n_cancelled": 0,
+            "generate_s": 0.0,
+            "ttft_s": 0.0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            # guided decoding cost: ttft of requests that compile their grammar vs
+            # ones the engine already compiled, at startup or by an earlier request
+            "n_new_move_set": 0,
+            "ttft_new_move_set_s": 0.0,
+            "n_seen_move_set": 0,
+            "ttft_seen_move_set_s": 0.0,
+        }
+
+    @modal.method()
+    async def get_engine_stats(self) -> dict:
+        return {
+            **self.stats,
+            "n_compiled_move_sets": get_guided_decoding.cache_info().currsize,
+        }
+
+    async def generate(
+        self, messages: list[dict[str, str]], sampling_params
+    ) -> tuple[str, dict]:
+        # same prompt as LLM.chat with our template
+        prompt_token_ids = self.tokenizer.apply_chat_template(
+            messages,
+            chat_template=self.chat_template,
+            add_generation_prompt=True,
+            tokenize=True,
+        )
+        request_id = uuid.uuid4().hex
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async for output in self.engine.generate(
+                {"prompt_token_ids": prompt_token_ids}, sampling_params, request_id
+            ):
+                if first_token is None:
+                    first_token = time.perf_counter()
+        except asyncio.CancelledError:
+            # the caller gave up (e.g. a newer frame arrived), free its batch slot
+            await self.engine.abort(request_id)
+            self.stats["n_cancelled"] += 1
+            raise
+        finally:
+            self.stats["generate_s"] += time.perf_counter() - start
+        metrics = {
+            "ttft_s": first_token - start,
+            "prompt_tokens": len(prompt_token_ids),
+            "cached_tokens": output.num_cached_tokens or 0,  # from the prefix cache
+        }
+        self.stats["n_requests"] += 1
+        for key, value in metrics.items():
+            self.stats[key] += value
+        return output.outputs[0].text, metrics
+
+    def create_sampling_params(
         self,
-        messages: list[dict[str, str]],
         character: str,
         super_art: int,
         super_count: int,
-        side: int,
         available_moves: list[str] | None = None,
-    ) -> tuple[list[int], str]:
-        from vllm.sampling_params import GuidedDecodingParams
-
+    ) -> tuple:  # (sampling params, whether the move set is new to this container)
         if available_moves is None:
             available_moves = get_available_instructions_for_character(
                 character, super_art, super_count
             )
 
-        self.sampling_params.guided_decoding = GuidedDecodingParams(
-            choice=available_moves,
-        )
-
-        outputs = self.llm.chat(
-            [messages],
-            self.sampling_params,
-            chat_template=remote_chat_template_path,
+        # per request, concurrent requests must never see each other's moves
+        sampling_params = self.sampling_params.clone()
+        n_misses = get_guided_decoding.cache_info().misses
+        # shallow copy, vllm fills in the backend on the params it's given
+        sampling_params.guided_decoding = copy.copy(
+            get_guided_decoding(tuple(sorted(set(available_moves))))
         )
-        move_name = outputs[0].outputs[0].text
+        return sampling_params, get_guided_decoding.cache_info().misses > n_misses
 
+    def to_move(
+        self, character: str, move_name: str, side: int
+    ) -> tuple[list[int], str]:
         move_sequence = parse_move(character, move_name, side)
         if move_sequence is not None:
             return move_sequence, move_name
         print(f"Invalid move: {move_name}")
         return [0], "No-Move"
 
+    async def respond(
+        self,
+        messages: list[dict[str, str]],
+        character: str,
+        super_art: int,
+        super_count: int,
+        side: int,
+        available_moves: list[str] | None = None,
+        return_timings: bool = False,
+    ):
+        start = time.perf_counter()
+        sampling_params, new_move_set = self.create_sampling_params(
+            character, super_art, super_count, available_moves
+        )
+        text, metrics = await self.generate(messages, sampling_params)
+        generated = time.perf_counter()
+        kind = "new" if new_move_set else "seen"
+        self.stats[f"n_{kind}_move_set"] += 1
+        self.stats[f"ttft_{kind}_move_set_s"] += metrics["ttft_s"]
+
+        moves, move_name = self.to_move(character, text, side)
+        if not return_timings:
+            return moves, move_name
+        timings = {
+            "generate_s": generated - start,
+            "parse_s": time.perf_counter() - generated,
+            "new_move_set": new_move_set,  # its grammar was compiled in generate
+            **metrics,
+        }
+        return moves, move_name, timings
+
+    @modal.method()
+    async def chat(
+        self,
+        messages: list[dict[str, str]],
+        character: str,
+        super_art: int,
+        super_count: int,
+        side: int,
+        available_moves: list[str] | None = None,
+        return_timings: bool = False,  # also return server-side timings for tracing
+    ) -> tuple[list[int], str] | tuple[list[int], str, dict]:
+        return await self.respond(
+            messages,
+            character,
+            super_art,
+            super_count,
+            side,
+            available_moves,
+            return_timings,
+        )
+
+    @modal.method()
+    async def chat_batch(self, requests: list[dict]) -> list[tuple]:  # as chat
+        # coalesced by the client, see gateway.py, the engine batches them anyway
+        return await asyncio.gather(
+            *[
+                self.respond(
+                    request["messages"],
+                    request["character"],
+                    request["super_art"],
+                    request["super_count"],
+                    request["side"],
+                    request.get("available_moves"),
+                    request.get("return_timings", False),
+                )
+                for request in requests
+            ]
+        )
+
 
 @app.local_entrypoint()
 async def local(
     n_samples: int = 100,
+    concurrency: str = "1",  # comma-separated, e.g. 1,2,4,8 to sweep in-flight requests
 ):
     llm = LLMServer()
-    llm.boot.remote()
+    await llm.boot.remote.aio()
 
-    ms_per_move = []
-    for sample_idx in range(n_samples):
+    async def decide(ms_per_move: list[float]):
         messages, character, super_art, super_count, side, available_moves = (
             create_random_messages()
         )
@@ -167,17 +381,121 @@ async def local(
         elapsed = (time.perf_counter() - start_time) * 1000
         n_moves = len(moves) if moves else 1
         ms_per_move.append(elapsed / n_moves)
-        print(f"Sample {sample_idx}: {moves}")
 
     percentiles = [50, 90, 95, 99]
-    sorted_ms = sorted(ms_per_move)
+    for n_concurrent in [int(n) for n in concurrency.split(",")]:
+        # each worker sends its next request as soon as the previous one returns
+        n_requests = max(n_samples, n_concurrent)
+        ms_per_move = []
+
+        async def worker(n: int, ms_per_move: list[float] = ms_per_move):
+            for _ in range(n):
+                await decide(ms_per_move)
+
+        stats_before = await llm.get_engine_stats.remote.aio()
+        start_time = time.perf_counter()
+        await asyncio.gather(
+            *[
+                worker(n_requests // n_concurrent + (idx < n_requests % n_concurrent))
+                for idx in range(n_concurrent)
+            ]
+        )
+        elapsed = time.perf_counter() - start_time
+        stats_after = await llm.get_engine_stats.remote.aio()
+
+        # little's law, time spent in the engine over wall time, which assumes a
+        # single container like get_engine_stats
+        generate_s = stats_after["generate_s"] - stats_before["generate_s"]
+        avg_in_flight = generate_s / elapsed
+        n_new, ttft_new, n_seen, ttft_seen = (
+            stats_after[key] - stats_before[key]
+            for key in [
+                "n_new_move_set",
+                "ttft_new_move_set_s",
+                "n_seen_move_set",
+                "ttft_seen_move_set_s",
+            ]
+        )
+
+        sorted_ms = sorted(ms_per_move)
+        results = {}
+        for p in percentiles:
+            idx = int(len(sorted_ms) * p / 100)
+            idx = min(max(idx - 1, 0), len(sorted_ms) - 1)
+            results[p] = sorted_ms[idx]
+        print("--------------------------------")
+        print(f"Concurrency {n_concurrent} ({n_requests} requests):")
+        print(f"  throughput: {n_requests / elapsed:.2f} decisions/s")
+        print(f"  avg in-flight requests: {avg_in_flight:.2f}")
+        print(
+            f"  compiled grammar reused: {n_seen / max(n_new + n_seen, 1):.1%}"
+            f" ({stats_after['n_compiled_move_sets']} move sets compiled)"
+        )
+        print(
+            f"  guided decoding: avg ttft {ttft_new / max(n_new, 1) * 1000:.2f}ms for"
+            f" {n_new} new move sets, {ttft_seen / max(n_seen, 1) * 1000:.2f}ms for"
+            f" {n_seen} repeats"
+        )
+        print("  latency per move percentiles (ms):")
+        for p in percentiles:
+            print(f"    p{p}: {results[p]:.2f}ms")
+    print("--------------------------------")
+
+
+@app.local_entrypoint()
+async def benchmark_layouts(n_matches: int = 8, decisions_per_match: int = 32):
+    import random
+
+    llm = LLMServer()
+    await llm.boot.remote.aio()
+
+    # consecutive decisions of the same matches for every layout, one at a time like
+    # a player, so each prompt can reuse what the previous one left in the cache
     results = {}
-    for p in percentiles:
-        idx = int(len(sorted_ms) * p / 100)
-        idx = min(max(idx - 1, 0), len(sorted_ms) - 1)
-        results[p] = sorted_ms[idx]
+    for layout in prompt_layouts:
+        random.seed(seed)
+        ttfts, prompt_tokens, cached_tokens = [], 0, 0
+        for _ in range(n_matches):
+            characters = (
+                random.choice(list(CHARACTER_MAPPING.values())),
+                random.choice(list(CHARACTER_MAPPING.values())),
+            )
+            super_arts = (random.randint(1, 3), random.randint(1, 3))
+            difficulty = random.choice(["basic", "advanced", "expert"])
+            for _ in range(decisions_per_match):
+                messages, character, super_art, super_count, side, available_moves = (
+                    create_random_messages(layout, characters, super_arts, difficulty)
+                )
+                _, _, timings = await llm.chat.remote.aio(
+                    messages,
+                    character,
+                    super_art,
+                    super_count,
+                    side,
+                    available_moves,
+                    return_timings=True,
+                )
+                ttfts.append(timings["ttft_s"] * 1000)
+                prompt_tokens += timings["prompt_tokens"]
+                cached_tokens += timings["cached_tokens"]
+        sorted_ttfts = sorted(ttfts)
+        results[layout] = {
+            "prefix_cache_hit_rate": cached_tokens / max(prompt_tokens, 1),
+            "prompt_tokens_avg": prompt_tokens / len(ttfts),
+            **{
+                f"ttft_ms_p{p}": sorted_ttfts[
+                    min(max(int(len(sorted_ttfts) * p / 100) - 1, 0), len(ttfts) - 1)
+                ]
+                for p in [50, 90]
+            },
+        }
+
     print("--------------------------------")
-    print("Latency per move percentiles (ms):")
-    for p in percentiles:
-        print(f"  p{p}: {results[p]:.2f}ms")
+    print(f"Prompt layouts ({n_matches} matches x {decisions_per_match} decisions):")
+    for layout, stats in results.items():
+        print(
+            f"  {layout}: prefix cache hit rate {stats['prefix_cache_hit_rate']:.1%},"
+            f" {stats['prompt_tokens_avg']:.0f} prompt tokens,"
+            f" ttft p50 {stats['ttft_ms_p50']:.2f}ms, p90 {stats['ttft_ms_p90']:.2f}ms"
+        )
     print("--------------------------------")
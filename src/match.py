@@ -0,0 +1,863 @@
+import asyncio
+import copy
+import math
+import random
+import struct
+import time
+
+from .utils import (
+    CHARACTER_TO_ID,
+    COMBOS,
+    SPECIAL_MOVES,
+    X_SIZE,
+    GameInfo,
+    PlayerState,
+    assign_boxes,
+    create_messages,
+    parse_move,
+)
+
+# match engine, independent of how frames and messages are transported
+
+
+def create_initial_game_state():
+    return {
+        "status": "initializing",
+        "scores": [0, 0],
+        "winner": "",
+        "error": "",
+    }
+
+
+def create_default_game_settings():
+    return {
+        "player1": {
+            "character": "Ken",
+            "outfit": 1,
+            "superArt": 1,
+        },
+        "player2": {
+            "character": "Ken",
+            "outfit": 1,
+            "superArt": 1,
+        },
+        "humanVsLlm": True,
+        "gamepadConnected": False,
+        "difficulty": "expert",
+    }
+
+
+def create_player_state(obs: dict, settings: dict) -> PlayerState:
+    return PlayerState(
+        character=settings["character"],
+        super_art=settings["superArt"],
+        wins=obs["wins"][0],
+        side=obs["side"],
+        stunned=obs["stunned"],
+        stun_bar=obs["stun_bar"][0],
+        health=obs["health"][0],
+        super_count=obs["super_count"][0],
+        super_bar=obs["super_bar"][0],
+    )
+
+
+# decision triggers
+
+trigger_names = [
+    "start",
+    "damage",
+    "distance",
+    "super_count",
+    "stun",
+    "side",
+    "queue_low",
+]
+decision_frames_smoothing = 0.1  # weight of the latest decision's latency
+
+
+def get_distance_bucket(
+    game_info: GameInfo, player1: PlayerState, player2: PlayerState
+) -> str | None:
+    p1_box, p2_box = assign_boxes(
+        player1.character,
+        player1.side,
+        player2.character,
+        game_info.boxes,
+        game_info.class_ids,
+    )
+    if p1_box is None or p2_box is None:
+        return None
+    p1_x_center = (p1_box[0] + p1_box[2]) / 2
+    p2_x_center = (p2_box[0] + p2_box[2]) / 2
+    distance = abs(p1_x_center - p2_x_center) / float(X_SIZE)
+    return "far" if distance > 0.1 else "close"  # same split as create_messages
+
+
+class DecisionTrigger:
+    # only ask for a move when the prompt would meaningfully change
+    # or the button queue is about to run dry
+
+    def __init__(self, min_queued_buttons: int = 4):  # until a decision is timed
+        self.min_queued_buttons = min_queued_buttons
+        self.decision_frames = None  # moving average of frames stepped per decision
+        self.counts = dict.fromkeys(trigger_names, 0)
+        self.n_skipped = 0
+        self.reset()
+
+    def reset(self):
+        # per deciding player, (player1, player2, distance) at its last decision,
+        # so changes add up until that player acts on them
+        self.baselines = {}
+
+    def update(
+        self,
+        player_idx: int,
+        game_info: GameInfo,
+        player1: PlayerState,
+        player2: PlayerState,
+    ) -> list[str]:
+        distance = get_distance_bucket(game_info, player1, player2)
+
+        events = []
+        if player_idx not in self.baselines:
+            events.append("start")
+        else:
+            prev_player1, prev_player2, prev_distance = self.baselines[player_idx]
+            pairs = [(prev_player1, player1), (prev_player2, player2)]
+            if any(prev.health != curr.health for prev, curr in pairs):
+                events.append("damage")
+            if (
+                distance is not None
+                and prev_distance is not None
+                and distance != prev_distance
+            ):  # ignore missed detections
+                events.append("distance")
+            if any(prev.super_count < curr.super_count for prev, curr in pairs):
+                events.append("super_count")
+            if any(not prev.stunned and curr.stunned for prev, curr in pairs):
+                events.append("stun")
+            if any(prev.side != curr.side for prev, curr in pairs):
+                events.append("side")
+
+        return events
+
+    def on_decide(
+        self,
+        player_idx: int,
+        game_info: GameInfo,
+        player1: PlayerState,
+        player2: PlayerState,
+    ):
+        distance = get_distance_bucket(game_info, player1, player2)
+        if distance is None and player_idx in self.baselines:
+            distance = self.baselines[player_idx][2]  # ignore missed detections
+        self.baselines[player_idx] = (player1, player2, distance)
+
+    def on_decided(self, n_frames: int):
+        # the game loop pops one queued button per frame, so decide once the queue
+        # covers no more frames than a decision takes, not before
+        if self.decision_frames is None:
+            self.decision_frames = float(n_frames)
+        else:
+            self.decision_frames += decision_frames_smoothing * (
+                n_frames - self.decision_frames
+            )
+        self.min_queued_buttons = math.ceil(self.decision_frames)
+
+    def should_decide(self, events: list[str], next_buttons: list) -> bool:
+        if events:
+            for event in events:
+                self.counts[event] += 1
+            return True
+        if len(next_buttons) <= self.min_queued_buttons:
+            self.counts["queue_low"] += 1
+            return True
+        self.n_skipped += 1
+        return False
+
+
+# frame preprocessing
+
+
+def preprocess_frame(frame, detector_input_size: tuple[int, int] | None = None):
+    import cv2
+
+    # one colour conversion shared by the jpg encoder and the detector,
+    # which has always been fed the channel-swapped observation
+    encoder_input = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+    detector_input = encoder_input
+    if detector_input_size is not None:
+        width, height = detector_input_size
+        frame_height, frame_width = encoder_input.shape[:2]
+        if width * height < frame_width * frame_height:  # only shrink the payload
+            detector_input = cv2.resize(encoder_input, (width, height))
+
+    return encoder_input, detector_input
+
+
+# (sequence number, server unix time in ms) prepended to each jpg for latency metrics
+frame_header = struct.Struct("<Id")
+
+
+def encode_frame(encoder_input) -> bytes:
+    import cv2
+
+    _, buffer = cv2.imencode(".jpg", encoder_input, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return buffer.tobytes()
+
+
+def pack_frame(seq: int, jpg: bytes) -> bytes:
+    return frame_header.pack(seq, time.time() * 1000) + jpg
+
+
+class MatchEngine:
+    def __init__(
+        self,
+        create_sandbox,  # async fn returning a sandbox running the diambra engine
+        sandbox=None,
+        llm=None,  # LLMClient, None -> robots pick random moves
+        yolo=None,  # YOLOClient, None -> robots play without character positions
+        detector_input_size: tuple[int, int] | None = None,  # (width, height)
+        send_frame=None,  # async fn receiving encoded jpg bytes
+        target_fps: float | None = 60.0,  # None -> uncapped
+        transition_duration: float = 3.0,  # seconds, matches frontend
+        event_triggered: bool = True,  # False -> ask for a move every iteration
+        tracer=None,  # Tracer, records spans of each decision
+    ):
+        self.create_sandbox = create_sandbox
+        self.llm = llm
+        self.yolo = yolo
+        self.detector_input_size = detector_input_size
+        self.send_frame = send_frame
+        self.target_fps = target_fps
+        self.trigger = DecisionTrigger() if event_triggered else None
+        self.tracer = tracer
+
+        # game state
+
+        self.env = None
+        self.sandbox = sandbox
+        self.game_running = False
+        self.game_settings = create_default_game_settings()
+        self.game_state = create_initial_game_state()
+
+        # per frame state
+
+        self.observation = None
+        self.info = None
+        self.frame_inputs = None  # (encoder input, detector input)
+
+        # transition state
+
+        self.in_transition = False
+        self.transition_start_time = None
+        self.transition_duration = transition_duration
+
+        # game duration state
+
+        self.player1_next_buttons = []
+        self.player2_next_buttons = []
+        self.next_buttons_limit = (
+            20  # simply for memory, roughly length of longest combo
+        )
+        self.player1_current_action = 0
+        self.actions = {"agent_0": 0, "agent_1": 0}
+
+        self.prev_player1_state = None
+        self.prev_player2_state = None
+        self.prev_game_info = None
+
+        self.player1_recent_move_names = []
+        self.player2_recent_move_names = []
+        self.recent_move_limit = 8  # memory + min for good move variety
+
+        # stats
+
+        self.n_frames = 0
+        self.n_frames_sent = 0  # also the sequence number of the last frame sent
+        self.n_decisions = 0
+        self.n_games = 0
+
+        # communication
+
+        self.outbound_message_queue = asyncio.Queue()
+        self.stop_event = asyncio.Event()
+
+    async def send_game_state(self):
+        await self.outbound_message_queue.put(
+            {"type": "game_state", "data": copy.deepcopy(self.game_state)}
+        )
+
+    async def handle_player_action(self, action_data):
+        if self.observation is None:
+            return
+
+        if not self.game_settings["humanVsLlm"]:
+            return
+
+        action = action_data["action"]
+
+        # super art
+
+        if action == 18:
+            super_art_name = action_data.get("super_art")
+            if not super_art_name:
+                return
+
+            p1_obs = self.observation["P1"]
+            p1_character = CHARACTER_TO_ID[self.game_settings["player1"]["character"]]
+            p1_direction = "left" if p1_obs["side"] == 0 else "right"
+
+            if (
+                p1_character in SPECIAL_MOVES
+                and super_art_name in SPECIAL_MOVES[p1_character]
+            ):
+                self.player1_next_buttons.extend(
+                    SPECIAL_MOVES[p1_character][super_art_name][p1_direction]
+                )
+
+        # combo
+
+        elif action == 19:
+            combo_name = action_data["combo"]
+
+            p1_obs = self.observation["P1"]
+            p1_character = CHARACTER_TO_ID[self.game_settings["player1"]["character"]]
+            p1_direction = "left" if p1_obs["side"] == 0 else "right"
+
+            if p1_character in COMBOS and combo_name in COMBOS[p1_character]:
+                self.player1_next_buttons.extend(
+                    COMBOS[p1_character][combo_name][p1_direction]
+                )
+
+        # normal move
+
+        else:
+            if action <= 8:  # directional, so don't queue
+                self.player1_current_action = action
+            else:  # attack moves (9-17), so queue
+                self.player1_next_buttons.append(action)
+
+    async def cleanup_environment(self):
+        print("Cleaning up environment...")
+        if self.env:
+            try:
+                self.env.close()
+            except Exception:
+                print("Warning: could not close environment")
+            finally:
+                self.env = None
+
+    async def prepare_for_next_game(self):
+        await self.cleanup_environment()
+
+        if self.sandbox:
+            print(f"Terminating sandbox {self.sandbox.object_id}")
+            self.sandbox.terminate()
+            self.sandbox = await self.create_sandbox()
+
+        self.game_running = False
+        self.game_state = create_initial_game_state()
+        self.observation = None
+        self.info = None
+        self.frame_inputs = None
+        self.player1_next_buttons = []
+        self.player2_next_buttons = []
+        self.player1_recent_move_names = []
+        self.player2_recent_move_names = []
+        self.player1_current_action = 0
+        self.actions = {"agent_0": 0, "agent_1": 0}
+        self.in_transition = False
+        self.transition_start_time = None
+        if self.trigger is not None:
+            self.trigger.reset()
+        if self.tracer is not None:
+            self.tracer.reset_queues()
+
+    async def cleanup(self):
+        print("Cleaning up resources...")
+        await self.cleanup_environment()
+        if self.sandbox:
+            print(f"Terminating sandbox {self.sandbox.object_id}")
+            self.sandbox.terminate()
+            self.sandbox = None
+
+    async def report_error(self, e: Exception):
+        self.game_state["status"] = "error"
+        self.game_state["error"] = str(e)
+        await self.send_game_state()
+        await self.prepare_for_next_game()
+        await self.send_game_state()
+
+    # robot
+
+    async def detect_characters(self, frame_inputs, character_ids: list[int]):
+        if self.yolo is None:
+            return [], []
+        encoder_input, detector_input = frame_inputs
+        frame_height, frame_width = encoder_input.shape[:2]
+        return await self.yolo.detect_characters(
+            character_ids,
+            input_img=detector_input,
+            frame_size=(frame_width, frame_height),
+        )
+
+    async def choose_move(
+        self,
+        messages: list[dict[str, str]],
+        player: PlayerState,
+        available_moves: list[str],
+        trace_id: int | None = None,
+    ) -> tuple[list[int], str]:
+        self.n_decisions += 1
+        if self.llm is None:
+            move_name = random.choice(available_moves)
+            start = time.perf_counter()
+            moves = parse_move(player.character, move_name, player.side)
+            if self.tracer is not None:
+                self.tracer.add_span("parse_move", trace_id, start, time.perf_counter())
+            return moves, move_name
+
+        if self.tracer is None:
+            return await self.llm.chat(
+                messages,
+                player.character,
+                player.super_art,
+                player.super_count,
+                player.side,
+                available_moves,
+            )
+
+        start = time.perf_counter()
+        moves, move_name, timings = await self.llm.chat(
+            messages,
+            player.character,
+            player.super_art,
+            player.super_count,
+            player.side,
+            available_moves,
+            return_timings=True,
+        )
+        end = time.perf_counter()
+        self.tracer.add_span("LLMServer.chat", trace_id, start, end, move=move_name)
+
+        # server clock isn't shared, so lay its spans out against the end of the rpc
+        parse_start = end - timings["parse_s"]
+        generate_start = parse_start - timings["generate_s"]
+        self.tracer.add_span(
+            "llm.generate",
+            trace_id,
+            generate_start,
+            parse_start,
+            "llm_server",
+            new_move_set=timings["new_move_set"],  # includes compiling its grammar
+        )
+        self.tracer.add_span("parse_move", trace_id, parse_start, end, "llm_server")
+        return moves, move_name
+
+    def enqueue_move(
+        self,
+        next_buttons: list,
+        recent_move_names: list,
+        moves,
+        move_name,
+        player_idx: int = 1,
+        trace_id: int | None = None,
+    ):
+        if self.tracer is not None:
+            self.tracer.on_enqueue(player_idx, trace_id, len(next_buttons))
+
+        next_buttons.extend(moves)
+        recent_move_names.append(move_name)
+
+        if len(next_buttons) > self.next_buttons_limit:
+            next_buttons.pop(0)
+            if self.tracer is not None:
+                self.tracer.on_consume(player_idx)  # dropped
+
+        if len(recent_move_names) > self.recent_move_limit:
+            recent_move_names.pop(0)
+
+    async def decide(
+        self,
+        game_info: GameInfo,
+        player: PlayerState,
+        opponent: PlayerState,
+        prev_player: PlayerState | None,
+        prev_opponent: PlayerState | None,
+        next_buttons: list,
+        recent_move_names: list,
+        player_idx: int,
+        trace_id: int | None = None,
+    ):
+        start = time.perf_counter()
+        messages, available_moves = create_messages(
+            game_info,
+            opponent,
+            player,
+            self.prev_game_info,
+            prev_opponent,
+            prev_player,
+            recent_move_names,
+            self.game_settings["difficulty"],
+        )
+        if self.tracer is not None:
+            self.tracer.add_span(
+                "create_messages",
+                trace_id,
+                start,
+                time.perf_counter(),
+                player=player_idx + 1,
+            )
+
+        moves, move_name = await self.choose_move(
+            messages, player, available_moves, trace_id
+        )
+
+        start = time.perf_counter()
+        self.enqueue_move(
+            next_buttons, recent_move_names, moves, move_name, player_idx, trace_id
+        )
+        if self.tracer is not None:
+            self.tracer.add_span(
+                "enqueue",
+                trace_id,
+                start,
+                time.perf_counter(),
+                player=player_idx + 1,
+                buttons=list(moves),
+            )
+
+    def should_decide(
+        self,
+        player_idx: int,
+        game_info: GameInfo,
+        player1: PlayerState,
+        player2: PlayerState,
+        next_buttons: list,
+    ) -> bool:
+        if self.trigger is None:
+            return True
+        events = self.trigger.update(player_idx, game_info, player1, player2)
+        if not self.trigger.should_decide(events, next_buttons):
+            return False
+        self.trigger.on_decide(player_idx, game_info, player1, player2)
+        return True
+
+    async def run_robot(self):
+        last_frame_inputs = None
+        while not self.stop_event.is_set():
+            await asyncio.sleep(0.001)
+
+            if not self.game_running or self.observation is None or self.in_transition:
+                continue
+
+            if (
+                "timer" not in self.observation or self.observation["timer"] is None
+            ):  # in case env was just reset
+                continue
+
+            if self.frame_inputs is None:  # no frame preprocessed yet
+                continue
+
+            # nothing new to detect or decide on until the game loop steps again
+            if self.frame_inputs is last_frame_inputs:
+                continue
+
+            start = time.perf_counter()
+            start_frames = self.n_frames
+
+            # this frame's values, the game loop replaces them while detection runs
+            timer = self.observation["timer"][0]
+            frame_inputs = last_frame_inputs = self.frame_inputs
+
+            obs_p1 = self.observation["P1"]
+            obs_p2 = self.observation["P2"]
+
+            p1_settings = self.game_settings["player1"]
+            p2_settings = self.game_settings["player2"]
+
+            observed = time.perf_counter()
+
+            boxes, class_ids = await self.detect_characters(
+                frame_inputs,
+                [
+                    CHARACTER_TO_ID[p1_settings["character"]],
+                    CHARACTER_TO_ID[p2_settings["character"]],
+                ],
+            )
+
+            detected = time.perf_counter()
+
+            game_info = GameInfo(
+                timer=timer,
+                boxes=boxes,
+                class_ids=class_ids,
+            )
+
+            player1 = create_player_state(obs_p1, p1_settings)
+            player2 = create_player_state(obs_p2, p2_settings)
+
+            deciding = [
+                not self.game_settings["humanVsLlm"]
+                and self.should_decide(
+                    0, game_info, player1, player2, self.player1_next_buttons
+                ),
+                self.should_decide(
+                    1, game_info, player1, player2, self.player2_next_buttons
+                ),
+            ]
+            if not any(deciding):  # keep prompt deltas relative to the last decision
+                continue
+
+            # only passes that decide are traced, their earlier spans are added now
+            trace_id = None
+            if self.tracer is not None:
+                trace_id = self.tracer.new_trace()
+                self.tracer.add_span(
+                    "observation", trace_id, start, observed, timer=timer
+                )
+                self.tracer.add_span(
+                    "YOLOServer.detect_characters", trace_id, observed, detected
+                )
+
+            decisions = []
+            if deciding[0]:
+                decisions.append(
+                    self.decide(
+                        game_info,
+                        player1,
+                        player2,
+                        self.prev_player1_state,
+                        self.prev_player2_state,
+                        self.player1_next_buttons,
+                        self.player1_recent_move_names,
+                        0,
+                        trace_id,
+                    )
+                )
+            if deciding[1]:
+                decisions.append(
+                    self.decide(
+                        game_info,
+                        player2,
+                        player1,
+                        self.prev_player2_state,
+                        self.prev_player1_state,
+                        self.player2_next_buttons,
+                        self.player2_recent_move_names,
+                        1,
+                        trace_id,
+                    )
+                )
+
+            # concurrently so both requests can share a batch
+            await asyncio.gather(*decisions)
+            if self.trigger is not None:
+                self.trigger.on_decided(self.n_frames - start_frames)
+
+            self.prev_game_info = game_info
+            self.prev_player1_state = player1
+            self.prev_player2_state = player2
+
+    # game loop
+
+    def create_environment(self):
+        import diambra.arena as arena
+        from diambra.arena import EnvironmentSettingsMultiAgent, Roles, SpaceTypes
+
+        p1_settings = self.game_settings["player1"]
+        p2_settings = self.game_settings["player2"]
+
+        disable_keyboard = not self.game_settings["humanVsLlm"]
+        disable_joystick = not self.game_settings["gamepadConnected"]
+
+        settings = EnvironmentSettingsMultiAgent(
+            step_ratio=1,
+            role=(Roles.P1, Roles.P2),
+            disable_keyboard=disable_keyboard,
+            disable_joystick=disable_joystick,
+            render_mode="rgb_array",
+            splash_screen=False,
+            grpc_timeout=30,
+            action_space=(SpaceTypes.DISCRETE, SpaceTypes.DISCRETE),
+            characters=[
+                p1_settings["character"],
+                p2_settings["character"],
+            ],
+            outfits=[
+                p1_settings["outfit"],
+                p2_settings["outfit"],
+            ],
+            super_art=[
+                p1_settings["superArt"],
+                p2_settings["superArt"],
+            ],
+        )
+        return arena.make("sfiii3n", settings)
+
+    def get_winner(self, p1_wins: int, p2_wins: int) -> str:
+        if self.game_settings["humanVsLlm"]:
+            names = ["YOU", "LLM"]
+        elif self.llm is None:
+            names = ["Bot 1", "Bot 2"]
+        else:
+            names = ["LLM 1", "LLM 2"]
+
+        if p1_wins > p2_wins:
+            self.game_state["scores"][0] += 1
+            return names[0]
+        elif p2_wins > p1_wins:
+            self.game_state["scores"][1] += 1
+            return names[1]
+        return "Draw"
+
+    async def run_game_loop(self):
+        loop = asyncio.get_event_loop()
+
+        while not self.stop_event.is_set():
+            if not self.game_running:
+                await asyncio.sleep(0.001)
+                continue
+
+            print("Creating DIAMBRA environment...")
+            try:
+                self.env = await asyncio.wait_for(
+                    asyncio.to_thread(self.create_environment),
+                    timeout=30,
+                )
+            except Exception as e:
+                print(f"Error creating DIAMBRA environment: {e}")
+                await self.report_error(e)
+                continue
+            print("DIAMBRA environment created successfully!")
+
+            self.game_state["status"] = "running"
+            await self.send_game_state()
+
+            try:
+                self.observation, self.info = self.env.reset()
+            except Exception as e:
+                print(f"Error during env.reset: {e}")
+                await self.report_error(e)
+                continue
+
+            # according to https://docs.diambra.ai/envs/games/
+            # SF3 runs at 164 FPS natively, but we want 60 FPS output
+            frame_interval = 1.0 / self.target_fps if self.target_fps else 0.0
+            next_frame_time = loop.time()
+
+            # game loop
+
+            while self.game_running and not self.stop_event.is_set():
+                current_time = loop.time()
+                sleep_time = next_frame_time - current_time
+                if sleep_time > 0:
+                    await asyncio.sleep(sleep_time)
+                else:
+                    await asyncio.sleep(0)
+                next_frame_time += frame_interval
+                applied_trace_ids = []  # decisions whose buttons this step applies
+
+                if self.in_transition:
+                    elapsed = loop.time() - self.transition_start_time
+                    if elapsed >= self.transition_duration:
+                        self.in_transition = False
+                        self.transition_start_time = None
+                else:
+                    if self.tracer is not None:
+                        if self.player1_next_buttons:
+                            applied_trace_ids += self.tracer.on_consume(0)
+                        if self.player2_next_buttons:
+                            applied_trace_ids += self.tracer.on_consume(1)
+                    step_start = time.perf_counter()
+
+                    self.actions = {
+                        "agent_0": self.player1_next_buttons.pop(0)
+                        if self.player1_next_buttons
+                        else (
+                            self.player1_current_action
+                            if self.game_settings["humanVsLlm"]
+                            else 0
+                        ),
+                        "agent_1": self.player2_next_buttons.pop(0)
+                        if self.player2_next_buttons
+                        else 0,
+                    }
+
+                    try:
+                        (
+                            self.observation,
+                            reward,
+                            terminated,
+                            truncated,
+                            self.info,
+                        ) = self.env.step(self.actions)
+                    except Exception as e:
+                        print(f"Error during env.step: {e}")
+                        await self.report_error(e)
+                        continue
+                    self.n_frames += 1
+
+                    if applied_trace_ids:
+                        self.tracer.add_span(
+                            "env.step (buttons applied)",
+                            applied_trace_ids,
+                            step_start,
+                            time.perf_counter(),
+                            "game_loop",
+                            actions=self.actions,
+                        )
+
+                    if self.info.get("game_done", False):
+                        if terminated or truncated:
+                            p1_wins = self.observation["P1"]["wins"][0]
+                            p2_wins = self.observation["P2"]["wins"][0]
+                            print(f"Game finished - P1: {p1_wins}, P2: {p2_wins}")
+
+                            self.n_games += 1
+                            self.game_state["status"] = "finished"
+                            self.game_state["winner"] = self.get_winner(
+                                p1_wins, p2_wins
+                            )
+                            await self.send_game_state()
+
+                            await self.prepare_for_next_game()
+                            await self.send_game_state()
+                            continue
+                    elif self.info.get("round_done", False):
+                        self.in_transition = True
+                        self.transition_start_time = loop.time()
+                        await self.outbound_message_queue.put(
+                            {
+                                "type": "transition",
+                                "data": {"transition_type": "round"},
+                            }
+                        )
+
+                if not self.in_transition:
+                    frame = self.observation.get("frame")
+                    if frame is not None:
+                        send_start = time.perf_counter()
+                        self.frame_inputs = preprocess_frame(
+                            frame, self.detector_input_size
+                        )
+                        if self.send_frame is not None:
+                            self.n_frames_sent += 1
+                            await self.send_frame(
+                                pack_frame(
+                                    self.n_frames_sent,
+                                    encode_frame(self.frame_inputs[0]),
+                                )
+                            )
+
+                        if self.tracer is not None and applied_trace_ids:
+                            self.tracer.add_span(
+                                "frame.send",
+                                applied_trace_ids,
+                                send_start,
+                                time.perf_counter(),
+                                "game_loop",
+                                flow_end=True,
+                            )
@@ -0,0 +1,102 @@
+import functools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import modal
+
+# opt-in wall-clock sampling profiler for the event loop and worker threads
+# writes folded stacks, e.g. `flamegraph.pl x.folded > x.svg` or drop into speedscope.app
+# SF3_PROFILE=1 modal serve/deploy/run ... to enable, nothing runs when it's off
+
+profile_enabled = os.environ.get("SF3_PROFILE", "0") == "1"
+profiling_secret = modal.Secret.from_dict(
+    {"SF3_PROFILE": "1" if profile_enabled else "0"}
+)
+
+interval_ms = 5.0  # 200Hz
+
+
+class Profiler:
+    def __init__(self, path: Path, interval_ms: float = interval_ms):
+        self.path = Path(path)
+        self.interval_s = interval_ms / 1000
+        self.counts = Counter()  # folded stack -> n samples
+        self.n_samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        while not self.stop_event.wait(self.interval_s):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.n_samples += 1
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Saved {self.n_samples} profile samples to {self.path}")
+
+
+def create_profiler(profiles_path: Path, name: str) -> Profiler:
+    return Profiler(
+        profiles_path / f"{name}-{int(time.time())}-{uuid.uuid4().hex[:8]}.folded"
+    )
+
+
+async def save_profiler(profiler: Profiler | None, volume: modal.Volume):
+    if profiler is None:
+        return
+    profiler.stop()
+    profiler.save()
+    await volume.commit.aio()
+
+
+def profiled(profiles_path: Path, volume: modal.Volume):
+    # profiles every call of an async fn, one file per call
+    def decorator(fn):
+        if not profile_enabled:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            profiler = create_profiler(profiles_path, fn.__name__)
+            profiler.start()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                await save_profiler(profiler, volume)
+
+        return wrapper
+
+    return decorator
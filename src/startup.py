@@ -0,0 +1,86 @@
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# container startup profiling
+# steps are timed in-process during @modal.enter, imports are profiled in a fresh
+# interpreter with -X importtime since they're already loaded (and snapshotted) by then
+
+
+class StartupProfiler:
+    def __init__(self, name: str):
+        self.name = name
+        self.steps = []  # (name, seconds)
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def import_modules(self, modules: list[str]):
+        import importlib
+
+        for module in modules:
+            with self.step(f"import {module}"):
+                importlib.import_module(module)
+
+    def get_report(self) -> dict:
+        return {
+            "name": self.name,
+            "steps": [{"name": name, "s": s} for name, s in self.steps],
+            "total_s": sum(s for _, s in self.steps),
+        }
+
+    def print_report(self):
+        print(format_report(self.get_report()))
+
+
+def profile_imports(modules: list[str], top_k: int = 15) -> list[dict]:
+    # cumulative import cost of each module from a cold interpreter
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "; ".join(f"import {module}" for module in modules),
+        ],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent.parent,
+    )
+
+    # lines look like `import time:       self [us] |  cumulative | imported package`
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append(
+            {
+                "name": name.strip(),
+                "self_s": int(self_us) / 1e6,
+                "cumulative_s": int(cumulative_us) / 1e6,
+            }
+        )
+
+    requested = [i for i in imports if i["name"] in modules]
+    slowest = sorted(imports, key=lambda i: i["self_s"], reverse=True)[:top_k]
+    return requested + [i for i in slowest if i not in requested]
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{report['name']} startup: {report['total_s']:.2f}s"]
+    for step in report["steps"]:
+        lines.append(f"  {step['name']}: {step['s'] * 1000:.1f}ms")
+    for i in report.get("imports", []):
+        lines.append(
+            f"  [import] {i['name']}: {i['cumulative_s'] * 1000:.1f}ms cumulative,"
+            f" {i['self_s'] * 1000:.1f}ms self"
+        )
+    return "\n".join(lines)
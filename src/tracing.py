@@ -0,0 +1,125 @@
+import collections
+import json
+import time
+from pathlib import Path
+
+# per-decision spans in the chrome trace event format, viewable in perfetto
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+thread_ids = {"robot": 1, "game_loop": 2, "llm_server": 3}
+# sessions can last a day, so only the most recent events are kept, ~100MB at most
+max_events = 500_000
+
+
+class Tracer:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.origin = time.perf_counter()
+        self.metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 0,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in thread_ids.items()
+        ]
+        self.events = collections.deque(maxlen=max_events)
+        self.n_traces = 0
+        self.flows_started = set()
+
+        # map queued buttons back to the decision that produced them
+        self.n_consumed = [0, 0]  # per player, buttons popped so far
+        self.pending = [[], []]  # per player, (trace id, index of first button)
+
+    def to_us(self, t: float) -> float:
+        return (t - self.origin) * 1e6
+
+    def new_trace(self) -> int:
+        self.n_traces += 1
+        return self.n_traces
+
+    def add_span(
+        self,
+        name: str,
+        trace_ids: int | list[int],
+        start: float,
+        end: float,
+        thread: str = "robot",
+        flow_end: bool = False,  # last span of the decision
+        **args,
+    ):
+        if isinstance(trace_ids, int):
+            trace_ids = [trace_ids]
+        tid = thread_ids[thread]
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "pid": 0,
+                "tid": tid,
+                "ts": self.to_us(start),
+                "dur": (end - start) * 1e6,
+                "args": {"trace_ids": trace_ids, **args},
+            }
+        )
+
+        # flow arrows link all spans of a decision across threads
+        for trace_id in trace_ids:
+            self.events.append(
+                {
+                    "name": "decision",
+                    "cat": "decision",
+                    "ph": "f"
+                    if flow_end
+                    else ("t" if trace_id in self.flows_started else "s"),
+                    "id": trace_id,
+                    "pid": 0,
+                    "tid": tid,
+                    "ts": self.to_us(start),
+                    "bp": "e",
+                }
+            )
+            if flow_end:
+                self.flows_started.discard(trace_id)
+            else:
+                self.flows_started.add(trace_id)
+
+    def on_enqueue(self, player_idx: int, trace_id: int, n_queued: int):
+        # n_queued: queue length before the decision's buttons were added
+        self.pending[player_idx].append(
+            (trace_id, self.n_consumed[player_idx] + n_queued)
+        )
+
+    def on_consume(self, player_idx: int) -> list[int]:
+        # returns decisions whose first button was just applied
+        self.n_consumed[player_idx] += 1
+        applied = [
+            trace_id
+            for trace_id, first_idx in self.pending[player_idx]
+            if first_idx < self.n_consumed[player_idx]
+        ]
+        if applied:
+            self.pending[player_idx] = [
+                (trace_id, first_idx)
+                for trace_id, first_idx in self.pending[player_idx]
+                if trace_id not in applied
+            ]
+        return applied
+
+    def reset_queues(self):
+        self.n_consumed = [0, 0]
+        self.pending = [[], []]
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(
+                {
+                    "traceEvents": [*self.metadata, *self.events],
+                    "displayTimeUnit": "ms",
+                },
+                f,
+            )
+        print(f"Saved {self.n_traces} decision traces to {self.path}")
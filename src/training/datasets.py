@@ -0,0 +1,180 @@
+import math
+import os
+import random
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+
+from ..utils import X_SIZE, Y_SIZE
+from .scenes import (
+    PackedReader,
+    init_worker,
+    is_packed,
+    is_streamed,
+    load_character_sprites,
+    read_stream_config,
+    render_random_scene,
+    to_yolo_label,
+)
+
+# ultralytics datasets for scenes that aren't one png + txt per file
+# only imported inside training containers, so ultralytics is imported at module level
+
+
+class PackedDataset(YOLODataset):
+    # reads a split written by PackedWriter, see scenes.py
+
+    def get_img_files(self, img_path):
+        self.reader = PackedReader(Path(img_path))
+        # never opened, but ultralytics keys labels and plots by file name
+        return [
+            str(Path(img_path) / f"scene_{idx:06d}.png")
+            for idx in range(len(self.reader))
+        ]
+
+    def get_labels(self):
+        labels = []
+        for idx, im_file in enumerate(self.im_files):
+            class_ids, bboxes = self.reader.read_labels(idx)
+            labels.append(
+                {
+                    "im_file": im_file,
+                    "shape": (Y_SIZE, X_SIZE),  # every scene is a full frame
+                    "cls": class_ids.reshape(-1, 1).astype("float32"),
+                    "bboxes": bboxes.astype("float32"),
+                    "segments": [],
+                    "keypoints": None,
+                    "normalized": True,
+                    "bbox_format": "xywh",
+                }
+            )
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        return resize_image(self.reader.read_image(i), self.imgsz, rect_mode)
+
+
+class StreamedDataset(YOLODataset):
+    # a fresh scene for every index of every epoch, rendered in the dataloader worker
+    # from in-memory sprites, see write_stream_config in scenes.py
+
+    def get_img_files(self, img_path):
+        self.stream = read_stream_config(img_path)
+        init_worker(  # forked dataloader workers inherit the sprites
+            load_character_sprites(
+                Path(self.stream["sprite_dir"]), self.stream["images_per_character"]
+            )
+        )
+        self.rng = None
+        self.rng_pid = None
+        return [
+            str(Path(img_path) / f"scene_{idx:06d}.png")
+            for idx in range(self.stream["n_scenes"])
+        ]
+
+    def get_labels(self):
+        # only known once a scene is rendered, see get_image_and_label
+        return [
+            {
+                "im_file": im_file,
+                "shape": (Y_SIZE, X_SIZE),
+                "cls": np.zeros((0, 1), dtype=np.float32),
+                "bboxes": np.zeros((0, 4), dtype=np.float32),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            }
+            for im_file in self.im_files
+        ]
+
+    def get_rng(self) -> random.Random:
+        # ultralytics seeds each worker deterministically, and workers persist
+        # across epochs, so every epoch continues the stream instead of repeating it
+        if self.rng_pid != os.getpid():
+            self.rng = random.Random(torch.initial_seed())
+            self.rng_pid = os.getpid()
+        return self.rng
+
+    def get_image_and_label(self, index):
+        # as BaseDataset.get_image_and_label, rendering instead of reading
+        scene, detections = render_random_scene(
+            self.get_rng(), self.stream["images_per_character"]
+        )
+        label = {
+            "im_file": self.im_files[index],
+            "cls": np.array([[char_id] for char_id, _ in detections], dtype=np.float32),
+            "bboxes": np.array(
+                [to_yolo_label(bbox, X_SIZE, Y_SIZE) for _, bbox in detections],
+                dtype=np.float32,
+            ),
+            "segments": [],
+            "keypoints": None,
+            "normalized": True,
+            "bbox_format": "xywh",
+        }
+        label["img"], label["ori_shape"], label["resized_shape"] = resize_image(
+            scene, self.imgsz, True
+        )
+        label["ratio_pad"] = (
+            label["resized_shape"][0] / label["ori_shape"][0],
+            label["resized_shape"][1] / label["ori_shape"][1],
+        )
+        if self.rect:
+            label["rect_shape"] = self.batch_shapes[self.batch[index]]
+        return self.update_labels_info(label)
+
+
+def resize_image(im, imgsz: int, rect_mode: bool = True):
+    # same resizing as BaseDataset.load_image
+    h0, w0 = im.shape[:2]
+    if rect_mode:
+        r = imgsz / max(h0, w0)
+        if r != 1:
+            w = min(math.ceil(w0 * r), imgsz)
+            h = min(math.ceil(h0 * r), imgsz)
+            im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    elif not (h0 == w0 == imgsz):
+        im = cv2.resize(im, (imgsz, imgsz), interpolation=cv2.INTER_LINEAR)
+    return im, (h0, w0), im.shape[:2]
+
+
+class SceneTrainer(DetectionTrainer):
+    # pass as YOLO.train(trainer=SceneTrainer), png splits load as usual
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        if is_packed(img_path):
+            dataset = PackedDataset
+        elif is_streamed(img_path):
+            dataset = StreamedDataset
+        else:
+            return super().build_dataset(img_path, mode, batch)
+
+        # as ultralytics' build_yolo_dataset
+        return dataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=self.args.cache or None,
+            single_cls=self.args.single_cls or False,
+            stride=32,  # yolov10's largest
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == "train" else 1.0,
+        )
+
+    def plot_training_labels(self):
+        if isinstance(self.train_loader.dataset, StreamedDataset):
+            return  # no labels until scenes are rendered
+        super().plot_training_labels()
@@ -6,8 +6,10 @@ from pathlib import Path
 import modal
 import modal.experimental
 
+from ..gateway import LocalYOLOClient, YOLOClient
 from ..llm import LLMServer
 from ..llm import app as llm_app
+from ..profiling import profiled, profiling_secret
 from ..utils import (
     CHARACTER_TO_ID,
     HEALTH_MAX,
@@ -23,6 +25,9 @@ from ..utils import (
 )
 from ..yolo import YOLOServer
 from ..yolo import app as yolo_app
+from ..yolo import cache_path as yolo_cache_path
+from ..yolo import cache_volume as yolo_cache_volume
+from ..yolo import cpu_model_name as yolo_cpu_model_name
 
 # Modal setup
 
@@ -64,6 +69,8 @@ train_image = (
         "flashinfer-python==0.2.6.post1",
         "huggingface_hub[hf_transfer]==0.34.4",
         "matplotlib==3.10.5",
+        "onnx==1.17.0",  # cpu detector backend
+        "onnxruntime==1.21.0",
         "openai==1.99.9",
         "torch==2.7.1",
         "trl==0.21.0",
@@ -96,6 +103,10 @@ hf_cache_vol = modal.Volume.from_name("sf3-huggingface-cache", create_if_missing
 vllm_cache_vol = modal.Volume.from_name("sf3-vllm-cache", create_if_missing=True)
 cache_path = Path("/cache")
 cache_volume = modal.Volume.from_name("sf3-llm-train-cache", create_if_missing=True)
+profiles_path = cache_path / "profiles"
+
+yolo_encoding = "png"  # detector rpc payload, lossless, see codec.py
+detector_backend = "remote"  # or "cpu" to detect inside each episode container
 
 # helper fns
 
@@ -113,12 +124,20 @@ async def create_llm(ckpt_path: str):
 
 
 async def create_yolo():
+    import asyncio
+
     try:
         print("Creating YOLO...")
-        yolo = YOLOServer()
-        await yolo.boot.remote.aio()
+        if detector_backend == "cpu":
+            client = await asyncio.to_thread(LocalYOLOClient, yolo_cpu_model_name)
+        else:
+            yolo = YOLOServer()
+            await yolo.boot.remote.aio()
+            # one episode, one frame at a time
+            client = YOLOClient(yolo, max_batch_size=1)
+            await client.negotiate(yolo_encoding)
         print("YOLO created")
-        return yolo
+        return client
     except Exception as e:
         print(f"Couldn't create YOLO: {e}", file=sys.stderr)
         return None
@@ -198,10 +217,12 @@ max_steps_without_reward = 128
 
 @app.function(
     image=train_image,
-    volumes={cache_path: cache_volume},
+    volumes={cache_path: cache_volume, yolo_cache_path: yolo_cache_volume},
     # region=region,
+    secrets=[profiling_secret],
     timeout=2 * 60 * minutes,
 )
+@profiled(profiles_path, cache_volume)
 async def run_episode_data(
     idx: int,
     split: str,
@@ -302,9 +323,9 @@ async def run_episode_data(
         # get info for prompt
         obs_p1 = observation["P1"]
         obs_p2 = observation["P2"]
-        boxes, class_ids = await yolo.detect_characters.remote.aio(
+        boxes, class_ids = await yolo.detect_characters(
             [CHARACTER_TO_ID[character], CHARACTER_TO_ID[character]],
-            observation["frame"],
+            frame=observation["frame"],
         )
         game_info = GameInfo(
             timer=observation["timer"][0],
@@ -434,9 +455,9 @@ async def run_episode_data(
             total_reward += reward
 
             if save_video:
-                boxes, class_ids = await yolo.detect_characters.remote.aio(
+                boxes, class_ids = await yolo.detect_characters(
                     [CHARACTER_TO_ID[character], CHARACTER_TO_ID[character]],
-                    observation["frame"],
+                    frame=observation["frame"],
                 )
                 frames.append(observation["frame"])
 
@@ -893,11 +914,12 @@ initial_rating = 1200.0
 
 @app.function(
     image=train_image,
-    volumes={cache_path: cache_volume},
+    volumes={cache_path: cache_volume, yolo_cache_path: yolo_cache_volume},
     # region=region,
-    secrets=[modal.Secret.from_name("openai-secret")],
+    secrets=[modal.Secret.from_name("openai-secret"), profiling_secret],
     timeout=2 * 60 * minutes,
 )
+@profiled(profiles_path, cache_volume)
 async def run_episode_eval(
     idx: int,
     project_name: str,
@@ -978,9 +1000,9 @@ async def run_episode_eval(
         # get info for prompt
         obs_p1 = observation["P1"]
         obs_p2 = observation["P2"]
-        boxes, class_ids = await yolo.detect_characters.remote.aio(
+        boxes, class_ids = await yolo.detect_characters(
             [CHARACTER_TO_ID[character], CHARACTER_TO_ID[character]],
-            observation["frame"],
+            frame=observation["frame"],
         )
         game_info = GameInfo(
             timer=observation["timer"][0],
@@ -1094,9 +1116,9 @@ async def run_episode_eval(
             total_reward += reward
 
             if save_video:
-                boxes, class_ids = await yolo.detect_characters.remote.aio(
+                boxes, class_ids = await yolo.detect_characters(
                     [CHARACTER_TO_ID[character], CHARACTER_TO_ID[character]],
-                    observation["frame"],
+                    frame=observation["frame"],
                 )
                 frames.append(observation["frame"])
 
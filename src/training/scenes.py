@@ -0,0 +1,510 @@
+import dataclasses
+import functools
+import hashlib
+import json
+import random
+import shutil
+from dataclasses import dataclass
+from itertools import product
+from pathlib import Path
+
+from ..utils import CHARACTER_MAPPING, X_SIZE, Y_SIZE, seed
+
+# synthetic yolo scenes: two character sprites composited on a black background
+# rendered in shards, one per split and character pair, each with its own seed,
+# so the dataset is identical however shards are spread over processes
+
+
+@dataclass
+class CharacterSprite:
+    character_id: int
+    character_name: str
+    images: list  # premultiplied uint8 BGRA arrays, see load_sprite
+
+    def digest(self) -> str:
+        h = hashlib.sha256()
+        for image in self.images:
+            h.update(str(image.shape).encode())
+            h.update(image.tobytes())
+        return h.hexdigest()
+
+
+@dataclass
+class Shard:
+    split: str
+    char1_id: int
+    char2_id: int
+    first_idx: int  # image index of the shard's first scene
+    n_scenes: int
+    images_per_character: int
+
+    @property
+    def seed(self) -> int:
+        key = f"{seed}/{self.split}/{self.char1_id}/{self.char2_id}"
+        return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "little")
+
+    @property
+    def name(self) -> str:
+        return f"{self.split}/{self.char1_id}/{self.char2_id}"
+
+    def content_hash(self, sprite_digests: dict[int, str], storage: str) -> str:
+        # everything the shard's files depend on, see manifests below
+        key = {
+            "generator": generator_config(),
+            "shard": dataclasses.asdict(self),
+            "seed": self.seed,
+            "sprites": [sprite_digests[self.char1_id], sprite_digests[self.char2_id]],
+            "storage": storage,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def plan_shards(
+    character_ids: list[int],
+    scenes_per_pair: dict[str, int],  # split -> scenes
+    images_per_character: int,
+) -> list[Shard]:
+    # same scene order and file names as rendering everything in one loop
+    shards = []
+    for split, n_scenes in scenes_per_pair.items():
+        pairs = product(character_ids, character_ids)
+        for pair_idx, (char1_id, char2_id) in enumerate(pairs):
+            shards.append(
+                Shard(
+                    split,
+                    char1_id,
+                    char2_id,
+                    pair_idx * n_scenes,
+                    n_scenes,
+                    images_per_character,
+                )
+            )
+    return shards
+
+
+# manifests
+# the content hash of every shard on disk, so reruns only render shards whose
+# sprites, settings or generator changed
+
+manifest_name = "manifest.json"
+generator_version = 1  # bump whenever a change below renders different scenes
+
+
+def generator_config() -> dict:
+    return {
+        "version": generator_version,
+        "size": [X_SIZE, Y_SIZE],
+        "rotation_angles": rotation_angles,
+        "blur_radii": blur_radii,
+        "png_compression": png_compression,
+    }
+
+
+def read_manifest(dataset_dir: Path) -> dict[str, str]:  # shard name -> hash
+    path = dataset_dir / manifest_name
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(dataset_dir: Path, hashes: dict[str, str]):
+    with open(dataset_dir / manifest_name, "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+
+
+def remove_extra_scenes(dataset_dir: Path, split: str, n_scenes: int):
+    # left behind when a split shrinks, ultralytics would train on every file it finds
+    for kind, suffix in [("images", ".png"), ("labels", ".txt")]:
+        for path in (dataset_dir / kind / split).glob(f"scene_*{suffix}"):
+            if int(path.stem.removeprefix("scene_")) >= n_scenes:
+                path.unlink()
+
+
+# rendering
+# sprites are decoded once into premultiplied arrays, so compositing is one
+# multiply-add per pixel and blurring or rotating doesn't bleed black into edges
+
+png_compression = 1  # fastest level, scenes are mostly flat black
+rotation_angles = [-5, -4, -3, -2, -1, 1, 2, 3, 4, 5]  # degrees
+blur_radii = [0.5, 1.0, 1.5, 2.0]  # gaussian sigma
+sprite_cache_size = 2048  # augmented variants per worker, ~50KB each
+
+
+def load_sprite(image):  # PIL
+    import numpy as np
+
+    rgba = np.asarray(image.convert("RGBA"))
+    alpha = rgba[:, :, 3:4].astype(np.uint16)
+    bgr = (rgba[:, :, 2::-1].astype(np.uint16) * alpha + 127) // 255
+    return crop_to_alpha(np.concatenate([bgr, alpha], axis=2).astype(np.uint8))
+
+
+def crop_to_alpha(sprite):
+    # tight box around visible pixels, so labels don't include transparent padding
+    import numpy as np
+
+    visible = sprite[:, :, 3] > 0
+    rows = np.flatnonzero(visible.any(axis=1))
+    cols = np.flatnonzero(visible.any(axis=0))
+    if rows.size == 0:
+        return sprite
+    return sprite[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+
+
+def rotate(sprite, angle: float):
+    # counterclockwise, expanding the canvas like PIL's rotate(expand=True)
+    import cv2
+    import numpy as np
+
+    height, width = sprite.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width = int(np.ceil(height * sin + width * cos))
+    new_height = int(np.ceil(height * cos + width * sin))
+    matrix[0, 2] += (new_width - width) / 2
+    matrix[1, 2] += (new_height - height) / 2
+    return cv2.warpAffine(
+        sprite, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR, borderValue=0
+    )
+
+
+def blur(sprite, radius: float):
+    import cv2
+    import numpy as np
+
+    pad = int(np.ceil(3 * radius))  # room for the blur to spread past the edges
+    sprite = cv2.copyMakeBorder(
+        sprite, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0
+    )
+    return cv2.GaussianBlur(sprite, (0, 0), radius)
+
+
+@functools.lru_cache(maxsize=sprite_cache_size)
+def get_variant(
+    character_id: int, image_idx: int, flip: bool, angle: float, radius: float
+):
+    import numpy as np
+
+    sprite = sprites[character_id].images[image_idx]
+    if flip:
+        sprite = np.ascontiguousarray(sprite[:, ::-1])
+    if angle:
+        sprite = rotate(sprite, angle)
+    if radius:
+        sprite = blur(sprite, radius)
+    return np.ascontiguousarray(crop_to_alpha(sprite))
+
+
+def sample_augmentation(is_training: bool, rng: random.Random) -> tuple[float, float]:
+    # (angle, blur radius), from fixed levels so variants can be cached
+    if not is_training:
+        return 0.0, 0.0
+    angle = rng.choice(rotation_angles) if rng.random() > 0.7 else 0.0
+    radius = rng.choice(blur_radii) if rng.random() > 0.6 else 0.0
+    return angle, radius
+
+
+def composite(scene, sprite, x: int, y: int) -> tuple[int, int, int, int]:
+    # premultiplied "over" onto the scene in place, returns the visible box
+    import numpy as np
+
+    height, width = sprite.shape[:2]
+    x1, y1 = max(x, 0), max(y, 0)
+    x2, y2 = min(x + width, scene.shape[1]), min(y + height, scene.shape[0])
+    src = sprite[y1 - y : y2 - y, x1 - x : x2 - x]
+    dst = scene[y1:y2, x1:x2]
+    transparency = 255 - src[:, :, 3:4].astype(np.uint16)
+    dst[:] = src[:, :, :3] + (dst * transparency + 127) // 255
+    return x1, y1, x2, y2
+
+
+def create_scene(
+    char1_data: CharacterSprite,
+    char2_data: CharacterSprite,
+    char1_img_idx: int,
+    char2_img_idx: int,
+    is_training: bool,
+    rng: random.Random,
+    min_separation: int = 50,
+):
+    import numpy as np
+
+    char1_img = get_variant(
+        char1_data.character_id,
+        char1_img_idx % len(char1_data.images),
+        False,
+        *sample_augmentation(is_training, rng),
+    )
+    char2_img = get_variant(
+        char2_data.character_id,
+        char2_img_idx % len(char2_data.images),
+        True,
+        *sample_augmentation(is_training, rng),
+    )
+    char1_height, char1_width = char1_img.shape[:2]
+    char2_height, char2_width = char2_img.shape[:2]
+
+    max_x_char1 = X_SIZE // 2 - min_separation // 2
+    max_x_char2 = X_SIZE // 2 + min_separation // 2
+
+    char1_x = rng.randint(10, max_x_char1)
+    char2_x = rng.randint(max_x_char2, X_SIZE - char2_width - 10)
+
+    # clamp Y position to ensure characters are at least partially visible
+    max_y_char1 = max(0, Y_SIZE - char1_height)
+    max_y_char2 = max(0, Y_SIZE - char2_height)
+
+    char1_y = rng.randint(0, max_y_char1) if max_y_char1 > 0 else 0
+    char2_y = rng.randint(0, max_y_char2) if max_y_char2 > 0 else 0
+
+    scene = np.zeros((Y_SIZE, X_SIZE, 3), dtype=np.uint8)  # BGR
+    bbox1 = composite(scene, char1_img, char1_x, char1_y)
+    bbox2 = composite(scene, char2_img, char2_x, char2_y)
+
+    return scene, [
+        (char1_data.character_id, bbox1),
+        (char2_data.character_id, bbox2),
+    ]
+
+
+def to_yolo_label(bbox: tuple, img_w: int, img_h: int) -> tuple[float, ...]:
+    # pixel corners -> normalized (x_center, y_center, width, height)
+    x1, y1, x2, y2 = bbox
+
+    x_center = (x1 + x2) / 2
+    y_center = (y1 + y2) / 2
+    bbox_w = x2 - x1
+    bbox_h = y2 - y1
+
+    return x_center / img_w, y_center / img_h, bbox_w / img_w, bbox_h / img_h
+
+
+def encode_scene(scene_img) -> bytes:
+    import cv2
+
+    _, buffer = cv2.imencode(
+        ".png", scene_img, [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    )
+    return buffer.tobytes()
+
+
+def write_scene(
+    dataset_dir: Path, split: str, image_idx: int, scene_img, detections: list
+):
+    filename = f"scene_{image_idx:06d}"
+    with open(dataset_dir / "images" / split / f"{filename}.png", "wb") as f:
+        f.write(encode_scene(scene_img))
+
+    img_h, img_w = scene_img.shape[:2]
+    with open(dataset_dir / "labels" / split / f"{filename}.txt", "w") as f:
+        for char_id, bbox in detections:
+            x_center, y_center, width, height = to_yolo_label(bbox, img_w, img_h)
+            f.write(f"{char_id} {x_center} {y_center} {width} {height}\n")
+
+
+# packed datasets
+# one split as three files instead of a png and a txt per scene, which is slow on
+# network volumes: concatenated pngs, their byte offsets, and one label table
+
+packed_dir_name = "packed"
+
+
+def is_packed(split_dir) -> bool:
+    return (Path(split_dir) / "offsets.npy").exists()
+
+
+class PackedWriter:
+    def __init__(self, split_dir: Path):
+        # written next to the split and swapped in on a clean exit, so an earlier
+        # pack stays readable for PackedWriter.copy until then
+        self.split_dir = split_dir
+        self.tmp_dir = split_dir.with_name(f"{split_dir.name}.tmp")
+        self.images = None
+        self.offsets = [0]
+        self.labels = []  # image index, class, x center, y center, width, height
+
+    def __enter__(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self.images = open(self.tmp_dir / "images.bin", "wb")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:  # keep the earlier pack, drop the half-written one
+            self.images.close()
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def add(self, encoded: bytes, detections: list):
+        image_idx = len(self.offsets) - 1
+        self.images.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+        for char_id, bbox in detections:
+            self.labels.append(
+                (image_idx, char_id, *to_yolo_label(bbox, X_SIZE, Y_SIZE))
+            )
+
+    def copy(self, reader: "PackedReader", first_idx: int, n_scenes: int):
+        # scenes of an unchanged shard, still encoded, from an earlier pack
+        for idx in range(first_idx, first_idx + n_scenes):
+            image_idx = len(self.offsets) - 1
+            encoded = reader.images[reader.offsets[idx] : reader.offsets[idx + 1]]
+            self.images.write(encoded.tobytes())
+            self.offsets.append(self.offsets[-1] + len(encoded))
+            rows = reader.labels[
+                reader.label_offsets[idx] : reader.label_offsets[idx + 1]
+            ]
+            self.labels.extend((image_idx, *row[1:]) for row in rows.tolist())
+
+    def close(self):
+        import numpy as np
+
+        self.images.close()
+        np.save(self.tmp_dir / "offsets.npy", np.array(self.offsets, dtype=np.int64))
+        np.save(
+            self.tmp_dir / "labels.npy",
+            np.array(self.labels, dtype=np.float32).reshape(-1, 6),
+        )
+        shutil.rmtree(self.split_dir, ignore_errors=True)
+        self.tmp_dir.rename(self.split_dir)
+
+
+class PackedReader:
+    def __init__(self, split_dir: Path):
+        import numpy as np
+
+        # memory-mapped, so only the scenes actually read come off the volume
+        self.images = np.memmap(split_dir / "images.bin", dtype=np.uint8, mode="r")
+        self.offsets = np.load(split_dir / "offsets.npy")
+        self.labels = np.load(split_dir / "labels.npy")
+        # labels are written in image order, so each image's rows are contiguous
+        self.label_offsets = np.searchsorted(
+            self.labels[:, 0], np.arange(len(self) + 1)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def read_image(self, idx: int):  # BGR
+        import cv2
+
+        encoded = self.images[self.offsets[idx] : self.offsets[idx + 1]]
+        return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    def read_labels(self, idx: int):
+        # (n,) class ids and (n, 4) normalized xywh boxes
+        rows = self.labels[self.label_offsets[idx] : self.label_offsets[idx + 1]]
+        return rows[:, 1].astype(int), rows[:, 2:]
+
+
+# streamed datasets
+# nothing but a config on disk, scenes are rendered by each dataloader worker on demand
+
+stream_dir_name = "stream"
+stream_config_name = "stream.json"
+
+
+def is_streamed(split_dir) -> bool:
+    return (Path(split_dir) / stream_config_name).exists()
+
+
+def write_stream_config(
+    split_dir: Path, sprite_dir: Path, images_per_character: int, n_scenes: int
+):
+    import json
+
+    split_dir.mkdir(parents=True, exist_ok=True)
+    with open(split_dir / stream_config_name, "w") as f:
+        json.dump(
+            {
+                "sprite_dir": str(sprite_dir),
+                "images_per_character": images_per_character,
+                "n_scenes": n_scenes,  # per epoch, every one freshly rendered
+            },
+            f,
+        )
+
+
+def read_stream_config(split_dir) -> dict:
+    import json
+
+    with open(Path(split_dir) / stream_config_name) as f:
+        return json.load(f)
+
+
+def load_character_sprites(
+    sprite_dir: Path, images_per_character: int
+) -> list[CharacterSprite]:
+    # from the pngs prepare_dataset downloads, one directory per character
+    from PIL import Image
+
+    return [
+        CharacterSprite(
+            character_id=character_id,
+            character_name=character_name,
+            images=[
+                load_sprite(
+                    Image.open(sprite_dir / character_name / f"{idx}.png").convert(
+                        "RGBA"
+                    )
+                )
+                for idx in range(images_per_character)
+            ],
+        )
+        for character_id, character_name in CHARACTER_MAPPING.items()
+    ]
+
+
+def render_random_scene(rng: random.Random, images_per_character: int):
+    # any pair, images and augmentation, for streamed training scenes
+    character_ids = list(sprites.keys())
+    return create_scene(
+        sprites[rng.choice(character_ids)],
+        sprites[rng.choice(character_ids)],
+        rng.randrange(images_per_character),
+        rng.randrange(images_per_character),
+        True,
+        rng,
+    )
+
+
+# process pool workers
+
+sprites = {}  # character id -> CharacterSprite, per worker, set by init_worker
+
+
+def init_worker(character_sprites: list[CharacterSprite]):
+    sprites.clear()
+    sprites.update({sprite.character_id: sprite for sprite in character_sprites})
+    get_variant.cache_clear()
+
+
+def iter_scenes(shard: Shard):
+    # only depends on the shard, never on which worker runs it or what ran before
+    rng = random.Random(shard.seed)
+    char1, char2 = sprites[shard.char1_id], sprites[shard.char2_id]
+    is_training = shard.split == "train"
+    n_images = shard.images_per_character
+
+    for scene_num in range(shard.n_scenes):
+        char1_img_idx = scene_num % n_images
+        char2_img_idx = (scene_num // n_images + scene_num) % n_images
+        scene_img, detections = create_scene(
+            char1, char2, char1_img_idx, char2_img_idx, is_training, rng
+        )
+        yield shard.first_idx + scene_num, scene_img, detections
+
+
+def render_shard(
+    shard: Shard, dataset_dir: Path, packed: bool = False
+) -> tuple[int, list]:
+    # writes pngs and labels itself, or returns (png, detections) for PackedWriter
+    scenes = []
+    for image_idx, scene_img, detections in iter_scenes(shard):
+        if packed:
+            scenes.append((encode_scene(scene_img), detections))
+        else:
+            write_scene(dataset_dir, shard.split, image_idx, scene_img, detections)
+    return shard.n_scenes, scenes
@@ -1,4 +1,3 @@
-from dataclasses import dataclass
 from pathlib import Path
 
 import modal
@@ -11,6 +10,7 @@ from ..utils import (
     minutes,
     seed,
 )
+from ..yolo import max_batch_size
 
 # Modal setup
 
@@ -32,6 +32,8 @@ train_image = (
         extra_index_url="https://download.pytorch.org/whl/cu128",
         extra_options="--index-strategy unsafe-best-match",
     )
+    # ultralytics' DDP workers import SceneTrainer from src.training.datasets
+    .env({"PYTHONPATH": "/root"})
 )
 onnx_image = (
     modal.Image.debian_slim(python_version=py_version)  # matching ld path
@@ -75,32 +77,57 @@ scenes_per_pair_train = (
     images_per_character * 9
 )  # multiple of images_per_character to use all character variations
 scenes_per_pair_val = images_per_character * 1  # same as train
-
-
-@dataclass
-class CharacterSprite:
-    character_id: int
-    character_name: str
-    images: list  # PIL
-    bboxes: list[tuple[int, int, int, int]]  # x1, y1, x2, y2
+n_dataset_workers = 32  # scene rendering processes, output doesn't depend on this
+# "png": a png + label txt per scene, "packed": the train split as a few large files,
+# much faster to write, commit and load from a volume, see PackedWriter in scenes.py
+# "stream": no train split at all, scenes are rendered on demand by the dataloader
+# workers, fresh every epoch, see StreamedDataset in datasets.py
+dataset_format = "png"
 
 
 @app.function(
-    image=train_image, volumes={cache_path: cache_volume}, timeout=60 * minutes
+    image=train_image,
+    volumes={cache_path: cache_volume},
+    cpu=n_dataset_workers,
+    timeout=60 * minutes,
 )
-def prepare_dataset():
-    import random
+def prepare_dataset(
+    n_workers: int = n_dataset_workers, dataset_format: str = dataset_format
+):
+    import collections
+    import contextlib
+    import itertools
+    import multiprocessing
+    import shutil
+    import time
+    from concurrent.futures import ProcessPoolExecutor
     from io import BytesIO
-    from itertools import product
 
-    import numpy as np
     import requests
     import yaml
     from bs4 import BeautifulSoup
-    from PIL import Image, ImageFilter
+    from PIL import Image
     from tqdm import tqdm
 
-    np.random.seed(seed)
+    from .scenes import (
+        CharacterSprite,
+        PackedReader,
+        PackedWriter,
+        init_worker,
+        is_packed,
+        load_sprite,
+        packed_dir_name,
+        plan_shards,
+        read_manifest,
+        remove_extra_scenes,
+        render_shard,
+        stream_dir_name,
+        write_manifest,
+        write_stream_config,
+    )
+
+    if dataset_format not in ["png", "packed", "stream"]:
+        raise ValueError(f"Unknown dataset format: {dataset_format}")
 
     print(f"Starting dataset preparation in {dataset_dir}...")
     images_dir = dataset_dir / "images"
@@ -138,7 +165,7 @@ def prepare_dataset():
         if all_exist:
             for idx in range(images_per_character):
                 image = Image.open(char_dir / f"{idx}.png").convert("RGBA")
-                images.append(image)
+                images.append(load_sprite(image))
         else:
             response = requests.get(f"{base_url}/{url_name}")
             soup = BeautifulSoup(response.text, "html.parser")
@@ -158,158 +185,149 @@ def prepare_dataset():
                 response = requests.get(image_url)
                 image = Image.open(BytesIO(response.content)).convert("RGBA")
                 image.save(char_dir / f"{idx}.png")
-                images.append(image)
+                images.append(load_sprite(image))
 
         character_sprites.append(
             CharacterSprite(
                 character_id=character_id,
                 character_name=character_name,
                 images=images,
-                bboxes=None,
             )
         )
 
-    def augment_character(img: Image, is_training: bool, flip: bool):
-        # horizontal flip
-        if flip:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT)
-
-        if not is_training:
-            return img
-
-        # small rotation
-        if random.random() > 0.7:
-            angle = random.uniform(-5, 5)
-            img = img.rotate(angle, expand=True, fillcolor=(0, 0, 0, 0))
-
-        # gaussian blur
-        if random.random() > 0.6:
-            radius = random.uniform(0, 2)
-            if radius > 0:
-                img = img.filter(ImageFilter.GaussianBlur(radius=radius))
-
-        return img
-
-    def create_scene(
-        char1_data,
-        char2_data,
-        char1_img_idx,
-        char2_img_idx,
-        is_training,
-        min_separation: int = 50,
-    ):
-        scene = Image.new("RGBA", (X_SIZE, Y_SIZE), (0, 0, 0, 255))
-
-        char1_img = char1_data.images[char1_img_idx % len(char1_data.images)].copy()
-        char2_img = char2_data.images[char2_img_idx % len(char2_data.images)].copy()
-
-        char1_img = augment_character(char1_img, is_training, flip=False)
-        char2_img = augment_character(char2_img, is_training, flip=True)
-
-        max_x_char1 = X_SIZE // 2 - min_separation // 2
-        max_x_char2 = X_SIZE // 2 + min_separation // 2
-
-        char1_x = random.randint(10, max_x_char1)
-        char2_x = random.randint(max_x_char2, X_SIZE - char2_img.width - 10)
-
-        # clamp Y position to ensure characters are at least partially visible
-        max_y_char1 = max(0, Y_SIZE - char1_img.height)
-        max_y_char2 = max(0, Y_SIZE - char2_img.height)
-
-        char1_y = random.randint(0, max_y_char1) if max_y_char1 > 0 else 0
-        char2_y = random.randint(0, max_y_char2) if max_y_char2 > 0 else 0
-
-        scene.paste(char1_img, (char1_x, char1_y), char1_img)
-        scene.paste(char2_img, (char2_x, char2_y), char2_img)
-
-        scene_rgb = Image.new("RGB", scene.size, (0, 0, 0))
-        scene_rgb.paste(
-            scene, mask=scene.split()[3] if len(scene.split()) == 4 else None
+    # render scenes, one shard per split and character pair
+
+    n_pairs = len(CHARACTER_MAPPING) ** 2
+    scenes_per_pair = {"train": scenes_per_pair_train, "val": scenes_per_pair_val}
+
+    # the val split stays pngs, benchmarks and the ultralytics validator read them
+    train_dir = images_dir / "train"
+    writer = None
+    previous = None  # the last pack, unchanged shards are copied from it
+    if dataset_format == "packed":
+        train_dir = dataset_dir / packed_dir_name / "train"
+        if is_packed(train_dir):
+            previous = PackedReader(train_dir)
+        writer = PackedWriter(train_dir)
+    elif dataset_format == "stream":
+        # training renders its own scenes, only the sprites and the val split are kept,
+        # so train scenes of earlier png or packed runs are deleted
+        remove_extra_scenes(dataset_dir, "train", 0)
+        shutil.rmtree(dataset_dir / packed_dir_name / "train", ignore_errors=True)
+        train_dir = dataset_dir / stream_dir_name / "train"
+        write_stream_config(
+            train_dir,
+            original_image_dir,
+            images_per_character,
+            n_pairs * scenes_per_pair.pop("train"),
         )
 
-        bbox1 = (
-            char1_x,
-            char1_y,
-            char1_x + char1_img.width,
-            char1_y + char1_img.height,
-        )
-        bbox2 = (
-            char2_x,
-            char2_y,
-            char2_x + char2_img.width,
-            char2_y + char2_img.height,
+    shards = plan_shards(
+        list(CHARACTER_MAPPING.keys()), scenes_per_pair, images_per_character
+    )
+
+    # only shards whose inputs changed since the last run are rendered again
+    manifest = read_manifest(dataset_dir)
+    sprite_digests = {
+        sprite.character_id: sprite.digest() for sprite in character_sprites
+    }
+    hashes = {
+        shard.name: shard.content_hash(
+            sprite_digests, dataset_format if shard.split == "train" else "png"
         )
+        for shard in shards
+    }
+    stale = {
+        shard.name
+        for shard in shards
+        if manifest.get(shard.name) != hashes[shard.name]
+        or (shard.split == "train" and writer is not None and previous is None)
+    }
+    # forget them until they're rendered, in case this run doesn't finish, along with
+    # shards that aren't planned anymore (e.g. train, when streaming)
+    write_manifest(
+        dataset_dir,
+        {k: v for k, v in manifest.items() if k in hashes and k not in stale},
+    )
 
-        return scene_rgb, [
-            (char1_data.character_id, bbox1),
-            (char2_data.character_id, bbox2),
-        ]
+    print(
+        f"\nGenerating {len(stale)} of {len(shards)} shards with {n_workers} workers, "
+        f"reusing {len(shards) - len(stale)}..."
+    )
+    start = time.perf_counter()
+    with (
+        writer or contextlib.nullcontext(),
+        ProcessPoolExecutor(
+            n_workers,
+            # forked workers inherit the sprites instead of unpickling them
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+            initargs=(character_sprites,),
+        ) as pool,
+        tqdm(
+            total=sum(shard.n_scenes for shard in shards if shard.name in stale),
+            desc="Scenes",
+        ) as pbar,
+    ):
 
-    character_pairs = list(product(character_sprites, character_sprites))
+        def submit(shard):
+            if shard.name not in stale:
+                return None
+            return pool.submit(
+                render_shard,
+                shard,
+                dataset_dir,
+                writer is not None and shard.split == "train",
+            )
 
-    print("\nGenerating dataset scenes...")
-    for split_name, scenes_per_pair in [
-        ("train", scenes_per_pair_train),
-        ("val", scenes_per_pair_val),
-    ]:
-        is_training = split_name == "train"
-        image_idx = 0
-
-        print(f"\nGenerating {split_name} split:")
-        pair_pbar = tqdm(character_pairs, desc=f"{split_name} pairs")
-
-        for char1, char2 in pair_pbar:
-            for scene_num in range(scenes_per_pair):
-                char1_img_idx = scene_num % images_per_character
-                char2_img_idx = (
-                    scene_num // images_per_character + scene_num
-                ) % images_per_character
-                scene_img, detections = create_scene(
-                    char1, char2, char1_img_idx, char2_img_idx, is_training
-                )
-
-                filename = f"scene_{image_idx:06d}"
-                scene_img.save(images_dir / split_name / f"{filename}.png")
-
-                img_w, img_h = scene_img.size
-                with open(labels_dir / split_name / f"{filename}.txt", "w") as f:
-                    for char_id, bbox in detections:
-                        x1, y1, x2, y2 = bbox
-
-                        x_center = (x1 + x2) / 2
-                        y_center = (y1 + y2) / 2
-                        bbox_w = x2 - x1
-                        bbox_h = y2 - y1
-
-                        x_center_norm = x_center / img_w
-                        y_center_norm = y_center / img_h
-                        width_norm = bbox_w / img_w
-                        height_norm = bbox_h / img_h
-
-                        f.write(
-                            f"{char_id} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n"
-                        )
-
-                image_idx += 1
+        # a few shards ahead of the writer, enough to keep every worker busy without
+        # rendered scenes piling up in memory
+        planned = iter(shards)
+        futures = collections.deque(
+            (shard, submit(shard)) for shard in itertools.islice(planned, 2 * n_workers)
+        )
+        # in submission order, so packed scenes land in the same order every run
+        while futures:
+            shard, future = futures.popleft()
+            for next_shard in itertools.islice(planned, 1):
+                futures.append((next_shard, submit(next_shard)))
+            if future is None:
+                if writer is not None and shard.split == "train":
+                    writer.copy(previous, shard.first_idx, shard.n_scenes)
+                continue
+            n_scenes, scenes = future.result()
+            for encoded, detections in scenes:
+                writer.add(encoded, detections)
+            pbar.update(n_scenes)
+    for split, n_scenes in scenes_per_pair.items():
+        if split == "val" or writer is None:
+            remove_extra_scenes(dataset_dir, split, n_pairs * n_scenes)
+    write_manifest(dataset_dir, hashes)
+    elapsed = time.perf_counter() - start
+    print(f"Rendered {pbar.n} scenes in {elapsed:.1f}s ({pbar.n / elapsed:.0f}/s)")
+
+    start = time.perf_counter()
+    cache_volume.commit()
+    print(f"Committed volume in {time.perf_counter() - start:.1f}s")
 
     config = {
         "path": str(dataset_dir),
-        "train": str(images_dir / "train"),
+        "train": str(train_dir),
         "val": str(images_dir / "val"),
         "names": CHARACTER_MAPPING,
     }
     with open(dataset_dir / "data.yaml", "w") as f:
         yaml.dump(config, f)
 
-    total_train_scenes = len(character_pairs) * scenes_per_pair_train
-    total_val_scenes = len(character_pairs) * scenes_per_pair_val
+    total_train_scenes = n_pairs * scenes_per_pair_train
+    total_val_scenes = n_pairs * scenes_per_pair_val
 
     print(
         f"\nDataset prepared:\n"
         f"  {images_per_character} images/sprite × {len(character_sprites)} sprites = {images_per_character * len(character_sprites)} total character images\n"
-        f"  {len(character_sprites)}×{len(character_sprites)} = {len(character_pairs)} character pairs\n"
-        f"  Training: {len(character_pairs)} pairs × {scenes_per_pair_train} scenes/pair = {total_train_scenes} scenes\n"
-        f"  Validation: {len(character_pairs)} pairs × {scenes_per_pair_val} scenes/pair = {total_val_scenes} scenes\n"
+        f"  {len(character_sprites)}×{len(character_sprites)} = {n_pairs} character pairs\n"
+        f"  Training: {n_pairs} pairs × {scenes_per_pair_train} scenes/pair = {total_train_scenes} scenes\n"
+        f"  Validation: {n_pairs} pairs × {scenes_per_pair_val} scenes/pair = {total_val_scenes} scenes\n"
         f"  Total: {total_train_scenes + total_val_scenes} scenes\n"
         f"  Image usage: Each character image used {scenes_per_pair_train} times in training, {scenes_per_pair_val} times in validation"
     )
@@ -318,6 +336,9 @@ def prepare_dataset():
 # training
 
 model_size = "yolov10n.pt"
+# exported at the native frame aspect instead of the default 640x640 square, the model
+# is fully convolutional and 384x224 are both multiples of the 32px stride
+imgsz = (Y_SIZE, X_SIZE)  # (height, width)
 n_gpu = 8
 gpu = f"h200:{n_gpu}"
 cpu = n_gpu * 8
@@ -335,12 +356,21 @@ memory = n_gpu * 8 * gb
 def train_model():
     import time
 
+    import yaml
     from ultralytics import YOLO
 
+    from .datasets import SceneTrainer
+    from .scenes import is_packed, is_streamed
+
     cache_volume.reload()
+    with open(dataset_dir / "data.yaml") as f:
+        train_dir = yaml.safe_load(f)["train"]
+    # nothing on disk to cache for packed or streamed splits
+    cache = "disk" if not (is_packed(train_dir) or is_streamed(train_dir)) else False
 
     model = YOLO(model_size)
     model.train(
+        trainer=SceneTrainer,  # reads packed and streamed splits too
         # dataset config
         data=str(dataset_dir / "data.yaml"),
         # optimization config
@@ -348,9 +378,13 @@ def train_model():
         batch=512 * n_gpu,
         seed=seed,
         epochs=50,
+        # letterboxed squares at the export's scale, rect batches would turn off
+        # shuffling and splits are stored in character-pair order
+        imgsz=max(imgsz),
         # data processing config
         workers=max(cpu // n_gpu, 1),  # split CPUs evenly across GPUs
-        cache="disk",  # cache preprocessed images deterministically
+        # cache preprocessed images deterministically, packed splits are memory-mapped
+        cache=cache,
         # model saving config
         project=str(runs_dir),
         name=time.strftime("%Y%m%d_%H%M%S"),
@@ -407,22 +441,269 @@ def export_onnx():
         raise ValueError("No best model found")
 
     model = YOLO(str(model_file))
-    model.export(format="onnx", half=True, device=0)
+    # dynamic batch so YOLOServer can run batches of concurrent requests at once
+    model.export(
+        format="onnx",
+        half=True,
+        device=0,
+        imgsz=imgsz,  # recorded in the metadata, see read_input_spec
+        dynamic=True,
+        batch=max_batch_size,
+    )
 
     print(f"Exported model to {model_file.with_suffix('.onnx')}")
 
 
+# export variants, compared on the validation split for the cpu detector backend
+
+n_calibration_scenes = 256  # validation scenes used to pick int8 activation ranges
+iou_threshold = 0.5  # for a detection to count towards recall
+variant_cpu = 4
+variant_threads = 2  # per detection, as in LocalYOLOClient
+
+
+def read_labels(label_path: Path) -> list[tuple[int, tuple[float, ...]]]:
+    # yolo labels back to (class id, (x1, y1, x2, y2)) in pixels
+    labels = []
+    for line in label_path.read_text().splitlines():
+        class_id, x_center, y_center, width, height = line.split()
+        x_center, width = float(x_center) * X_SIZE, float(width) * X_SIZE
+        y_center, height = float(y_center) * Y_SIZE, float(height) * Y_SIZE
+        labels.append(
+            (
+                int(class_id),
+                (
+                    x_center - width / 2,
+                    y_center - height / 2,
+                    x_center + width / 2,
+                    y_center + height / 2,
+                ),
+            )
+        )
+    return labels
+
+
+def get_iou(box1, box2) -> float:
+    x1, y1 = max(box1[0], box2[0]), max(box1[1], box2[1])
+    x2, y2 = min(box1[2], box2[2]), min(box1[3], box2[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    return intersection / max(area1 + area2 - intersection, 1e-9)
+
+
+def quantize_int8(model_path: Path, output_path: Path, scene_paths: list[Path]):
+    import cv2
+    import numpy as np
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    from ..detector import FrameBuffers, read_input_spec
+
+    model = onnx.load(str(model_path))
+    input_name, input_height, input_width, _ = read_input_spec(model)
+
+    class SceneReader(CalibrationDataReader):
+        # feeds scenes through the same preprocessing the detector uses
+        def __init__(self):
+            self.paths = iter(scene_paths)
+            self.buffers = FrameBuffers(1, input_height, input_width, np.float32)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            self.buffers.prepare(0, cv2.imread(str(path)))
+            return {input_name: self.buffers.to_tensor(1).copy()}
+
+    preprocessed_path = output_path.with_suffix(".pre.onnx")
+    quant_pre_process(str(model_path), str(preprocessed_path), skip_symbolic_shape=True)
+    quantize_static(
+        str(preprocessed_path),
+        str(output_path),
+        SceneReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    preprocessed_path.unlink()
+
+    # keep the ultralytics metadata (imgsz, names) the detector and validator read
+    quantized = onnx.load(str(output_path))
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, str(output_path))
+
+
+def evaluate_variant(model_path: Path, scene_paths: list[Path]) -> dict:
+    import time
+
+    import cv2
+    import numpy as np
+    from ultralytics import YOLO
+
+    from ..detector import create_cpu_detector
+
+    # recall through the same path the game uses: best box per character on screen
+    detector = create_cpu_detector(model_path, n_threads=variant_threads)
+    latencies, inference_times = [], []
+    n_labels = n_found = 0
+    for scene_path in scene_paths:
+        labels = read_labels(dataset_dir / "labels" / "val" / f"{scene_path.stem}.txt")
+        frame = cv2.imread(str(scene_path))
+
+        start = time.perf_counter()
+        boxes, class_ids, timings = detector.detect(
+            [class_id for class_id, _ in labels], frame, return_timings=True
+        )
+        latencies.append(time.perf_counter() - start)
+        inference_times.append(timings["inference_s"])
+
+        # matched one to one by iou, mirror scenes have two labels of one class
+        unmatched = list(zip(boxes, class_ids))
+        for class_id, label_box in labels:
+            n_labels += 1
+            for idx, (box, found_id) in enumerate(unmatched):
+                if found_id == class_id and get_iou(box, label_box) >= iou_threshold:
+                    n_found += 1
+                    del unmatched[idx]
+                    break
+
+    # map over every detection, from ultralytics' own validator
+    input_height, input_width = detector.input_height, detector.input_width
+    metrics = YOLO(str(model_path), task="detect").val(
+        data=str(dataset_dir / "data.yaml"),
+        split="val",
+        imgsz=[input_height, input_width],
+        batch=16,
+        device="cpu",
+        plots=False,
+        project=str(runs_dir / "variants"),
+        name=model_path.stem,
+        exist_ok=True,
+    )
+
+    return {
+        "variant": model_path.stem.removeprefix("best").lstrip(".") or "fp16",
+        "path": str(model_path),
+        "size_mb": model_path.stat().st_size / 1e6,
+        "recall": n_found / max(n_labels, 1),
+        "map50": float(metrics.box.map50),
+        "map50_95": float(metrics.box.map),
+        "latency_ms_p50": float(np.percentile(latencies, 50)) * 1000,
+        "latency_ms_p90": float(np.percentile(latencies, 90)) * 1000,
+        "inference_ms_p50": float(np.percentile(inference_times, 50)) * 1000,
+    }
+
+
+@app.function(
+    image=onnx_image,
+    volumes={cache_path: cache_volume},
+    cpu=variant_cpu,
+    timeout=2 * 60 * minutes,
+)
+def export_variants(prune: bool = False) -> list[dict]:
+    import json
+    import random
+    import shutil
+
+    import onnx
+    from ultralytics import YOLO
+
+    from ..detector import load_model
+
+    cache_volume.reload()
+    model_file = find_best_model("onnx")
+    if model_file is None:
+        raise ValueError("No exported model found, run with --export first")
+    scene_paths = sorted((dataset_dir / "images" / "val").glob("*.png"))
+    if not scene_paths:
+        raise ValueError("No validation scenes found, run with --prepare first")
+    random.seed(seed)
+    calibration_paths = random.sample(
+        scene_paths, min(n_calibration_scenes, len(scene_paths))
+    )
+
+    # what the cpu detector runs today: the fp16 export converted at load
+    fp32_file = model_file.with_name("best.fp32.onnx")
+    onnx.save(load_model(model_file, float32=True), str(fp32_file))
+    variant_files = [fp32_file]
+
+    int8_file = model_file.with_name("best.int8.onnx")
+    quantize_int8(fp32_file, int8_file, calibration_paths)
+    variant_files.append(int8_file)
+
+    if prune:
+        # at most one box per class is ever used, so the end-to-end head only needs
+        # to keep as many candidates as there are classes instead of 300
+        pruned_pt = model_file.with_name("best.pruned.pt")
+        shutil.copy(model_file.with_suffix(".pt"), pruned_pt)
+        YOLO(str(pruned_pt)).export(
+            format="onnx",
+            half=False,  # fp32 for the cpu, so no gpu needed for the export
+            device="cpu",
+            imgsz=imgsz,
+            dynamic=True,
+            batch=max_batch_size,
+            max_det=len(CHARACTER_MAPPING),
+        )
+        pruned_file = pruned_pt.with_suffix(".onnx")
+        pruned_int8_file = model_file.with_name("best.pruned.int8.onnx")
+        quantize_int8(pruned_file, pruned_int8_file, calibration_paths)
+        variant_files += [pruned_file, pruned_int8_file]
+
+    results = []
+    for variant_file in variant_files:
+        print(f"Evaluating {variant_file}...")
+        results.append(evaluate_variant(variant_file, scene_paths))
+
+    with open(model_file.with_name("variants.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
 @app.local_entrypoint()
 async def main(
     prepare: bool = False,
     train: bool = False,
     export: bool = False,
+    dataset_format: str = dataset_format,  # png, packed or stream
+    variants: bool = False,  # int8 (and with --prune, pruned) cpu variants + report
+    prune: bool = False,
 ):
     if prepare:
-        prepare_dataset.remote()
+        prepare_dataset.remote(dataset_format=dataset_format)
 
     if train:
         train_model.remote()
 
     if export:
         export_onnx.remote()
+
+    if variants:
+        results = export_variants.remote(prune)
+        print("--------------------------------")
+        print(
+            f"Export variants on the validation split (CPU, {variant_threads} threads):"
+        )
+        print(
+            "  variant           size MB   recall    mAP50  mAP50-95"
+            "   p50 ms   p90 ms  inference p50 ms"
+        )
+        for result in results:
+            print(
+                f"  {result['variant']:<16} {result['size_mb']:>8.1f}"
+                f" {result['recall']:>8.3f} {result['map50']:>8.3f}"
+                f" {result['map50_95']:>9.3f} {result['latency_ms_p50']:>8.2f}"
+                f" {result['latency_ms_p90']:>8.2f} {result['inference_ms_p50']:>17.2f}"
+            )
+        print(
+            "  pick the fastest variant with enough recall, see cpu_model_name in src/yolo.py"
+        )
+        print("--------------------------------")
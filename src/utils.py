@@ -1751,6 +1751,9 @@ class PlayerState:
 @dataclass
 class GameInfo:
     timer: int
+    # one row per requested character, as returned by the detector:
+    # (n, 4) float32 xmin, ymin, xmax, ymax and (n,) int class ids, -1 if not detected
+    # plain lists work too
     boxes: list
     class_ids: list
 
@@ -1759,8 +1762,8 @@ def assign_boxes(
     p1_char: str,
     p1_side: int,
     p2_char: str,
-    boxes: list[list[int]],
-    class_ids: list[int],
+    boxes,  # (n, 4) array or list of boxes
+    class_ids,  # (n,) array or list
 ) -> tuple:
     p1_box = None
     p2_box = None
@@ -1768,22 +1771,20 @@ def assign_boxes(
     p1_char_id = CHARACTER_TO_ID[p1_char]
     p2_char_id = CHARACTER_TO_ID[p2_char]
 
+    # rows of an array are views, so nothing is copied or converted to lists
+    valid_boxes = [
+        (class_id, box) for class_id, box in zip(class_ids, boxes) if class_id != -1
+    ]
+
     if p1_char_id != p2_char_id:  # characters are different
-        for i, class_id in enumerate(class_ids):
-            if class_id == -1:
-                continue
-            if class_id == p1_char_id and i < len(boxes):
-                p1_box = boxes[i]
-            elif class_id == p2_char_id and i < len(boxes):
-                p2_box = boxes[i]
+        for class_id, box in valid_boxes:
+            if class_id == p1_char_id:
+                p1_box = box
+            elif class_id == p2_char_id:
+                p2_box = box
     else:  # characters are the same
-        valid_boxes = [
-            (i, box)
-            for i, (class_id, box) in enumerate(zip(class_ids, boxes))
-            if class_id != -1
-        ]
         if len(valid_boxes) == 2:  # two characters detected
-            (i0, box0), (i1, box1) = valid_boxes
+            (_, box0), (_, box1) = valid_boxes
             x_center_0 = (box0[0] + box0[2]) / 2
             x_center_1 = (box1[0] + box1[2]) / 2
 
@@ -1820,6 +1821,27 @@ def assign_boxes(
     return p1_box, p2_box
 
 
+# "state_first" is the layout checkpoints so far were trained and served with,
+# "catalog_first" leads with what's fixed for a whole match (persona, characters and
+# the numbered move catalog) so vllm's prefix cache shares it between decisions,
+# see benchmark_layouts in llm.py. training and serving must use the same one
+prompt_layouts = ["state_first", "catalog_first"]
+prompt_layout = "state_first"
+
+
+def format_move_numbers(numbers: list[int]) -> str:
+    # sorted, e.g. [1, 2, 3, 5] -> "1-3, 5"
+    runs = []
+    for number in numbers:
+        if runs and number == runs[-1][1] + 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return ", ".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in runs
+    )
+
+
 def create_messages(
     game_info: GameInfo,
     player1: PlayerState,
@@ -1829,7 +1851,11 @@ def create_messages(
     prev_player2=None,
     recent_moves=None,
     difficulty: str = "expert",
+    layout: str = prompt_layout,
 ) -> tuple[list[dict[str, str]], list[str]]:
+    if layout not in prompt_layouts:
+        raise ValueError(f"Unknown prompt layout: {layout}")
+
     past_info_available = (
         prev_game_info is not None
         and prev_player1 is not None
@@ -1939,6 +1965,43 @@ def create_messages(
         available_moves = [m for m in available_moves if m not in filtered_recent_moves]
         if not available_moves:
             available_moves = list(CLOSE_IN_MOVES.keys())
+
+    if layout == "catalog_first":
+        # every move the character could have this match, whatever the super count
+        catalog = get_available_instructions_for_character(
+            player2.character, player2.super_art, 3, difficulty
+        )
+        if len(available_moves) == len(catalog):
+            allowed_prompt = "You may use any of your moves."
+        else:
+            numbers = [catalog.index(move) + 1 for move in available_moves]
+            allowed_prompt = (
+                f"You may only use moves {format_move_numbers(sorted(numbers))}."
+            )
+        system_prompt = [
+            "You are the most aggressive Street Fighter III 3rd strike player in the world.",
+            f"Your character: {player2.character} (super art {player2.super_art}), opponent character: {player1.character}",
+            "",
+            "Your moves:",
+            *(f"{number}. {move}" for number, move in enumerate(catalog, 1)),
+            "",
+            "Simply respond with just the entire name of the best move.",
+        ]
+        state_prompt = [
+            f"Timer: {game_info.timer}, best of 3: you've won {player2.wins} rounds, opponent has won {player1.wins} rounds",
+            position_prompt,
+            health_prompt,
+            stun_prompt,
+            power_prompt,
+            allowed_prompt,
+            "Your next move is:",
+        ]
+        messages = [
+            {"role": "system", "content": "\n".join(system_prompt)},
+            {"role": "user", "content": "\n".join(filter(None, state_prompt))},
+        ]
+        return messages, available_moves
+
     moves_prompt = "You may only use the following moves:\n"
     moves_prompt += chr(10).join("- " + move for move in available_moves)
 
@@ -1976,18 +2039,26 @@ def est_super_ct(super_bar: int) -> int:
         return 0
 
 
-def create_random_messages() -> tuple[
-    list[dict[str, str]], str, int, int, int, list[str]
-]:  # for warmup, testing
+def create_random_messages(
+    layout: str = prompt_layout,
+    characters: tuple[str, str] | None = None,  # (player 1, player 2), fixed per match
+    super_arts: tuple[int, int] | None = None,
+    difficulty: str | None = None,
+) -> tuple[list[dict[str, str]], str, int, int, int, list[str]]:  # for warmup, testing
     import random
 
     n_detected_characters = random.randint(1, 2)
 
-    player1_character = random.choice(list(CHARACTER_MAPPING.values()))
-    player2_character = random.choice(list(CHARACTER_MAPPING.values()))
+    if characters is None:
+        characters = (
+            random.choice(list(CHARACTER_MAPPING.values())),
+            random.choice(list(CHARACTER_MAPPING.values())),
+        )
+    player1_character, player2_character = characters
 
-    player1_super_art = random.randint(1, 3)
-    player2_super_art = random.randint(1, 3)
+    if super_arts is None:
+        super_arts = (random.randint(1, 3), random.randint(1, 3))
+    player1_super_art, player2_super_art = super_arts
 
     side = random.randint(0, 1)
 
@@ -2041,10 +2112,11 @@ def create_random_messages() -> tuple[
         super_bar=player2_super_bar,
     )
 
-    random_difficulty = random.choice(["basic", "advanced", "expert"])
+    if difficulty is None:
+        difficulty = random.choice(["basic", "advanced", "expert"])
 
     messages, available_moves = create_messages(
-        game_info, player1, player2, difficulty=random_difficulty
+        game_info, player1, player2, difficulty=difficulty, layout=layout
     )
 
     return (
@@ -1,7 +1,14 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import modal
 
+from .codec import decode_image, encodings
+from .detector import Detector, FrameBuffers, load_model, read_input_spec
+from .gateway import Coalescer, LocalYOLOClient, YOLOClient
+from .startup import StartupProfiler, profile_imports
 from .utils import (
     CHARACTER_MAPPING,
     X_SIZE,
@@ -50,9 +57,16 @@ cache_path = Path("/root/yolo")
 # inference
 
 model_name = cache_path / "runs" / "2025-07-18" / "weights" / "best.onnx"
+# for LocalYOLOClient, e.g. best.int8.onnx, see export_variants in src/training/yolo.py
+cpu_model_name = model_name
 max_inputs = 512
 gpu = "b200"
 
+# server-side micro-batching of concurrent requests
+batch_window_ms = 2.0
+max_batch_size = 32  # exported models accept up to this many frames per run
+n_inference_threads = 4  # batches in flight at once, each with its own session
+
 
 @app.cls(
     image=onnx_image,
@@ -67,163 +81,168 @@ gpu = "b200"
 class YOLOServer:
     @modal.enter()
     def enter(self):
-        import cv2
+        self.startup_profiler = StartupProfiler("YOLOServer")
+        self.startup_profiler.import_modules(["cv2", "numpy", "onnx", "onnxruntime"])
         import numpy as np
         import onnxruntime
 
-        onnxruntime.set_seed(seed)
-        onnxruntime.preload_dlls()
+        with self.startup_profiler.step("onnxruntime.preload_dlls"):
+            onnxruntime.set_seed(seed)
+            onnxruntime.preload_dlls()
 
-        cache_volume.reload()
+        with self.startup_profiler.step("cache_volume.reload"):
+            cache_volume.reload()
         print(f"Loading model from {model_name}")
 
-        self.session = onnxruntime.InferenceSession(
-            model_name,
-            providers=[
-                (
-                    "TensorrtExecutionProvider",
-                    {
-                        "trt_engine_cache_enable": True,
-                        "trt_engine_cache_path": cache_path / "onnx.cache",
-                    },
-                ),
-                "CUDAExecutionProvider",
-            ],
-        )
-
-        model_inputs = self.session.get_inputs()
-        self.input_names = [model_inputs[i].name for i in range(len(model_inputs))]
+        with self.startup_profiler.step("load model"):
+            model = load_model(model_name)
+        input_name, input_height, input_width, dynamic_batch = read_input_spec(model)
 
-        self.input_shape = model_inputs[0].shape
-        self.input_height = self.input_shape[2]
-        self.input_width = self.input_shape[3]
+        trt_options = {
+            "trt_engine_cache_enable": True,
+            "trt_engine_cache_path": cache_path / "onnx.cache",
+        }
+        if dynamic_batch:
+            # build one engine covering every batch size instead of one per size
+            shape = f"{input_name}:{{}}x3x{input_height}x{input_width}"
+            trt_options |= {
+                "trt_profile_min_shapes": shape.format(1),
+                "trt_profile_opt_shapes": shape.format(max_batch_size),
+                "trt_profile_max_shapes": shape.format(max_batch_size),
+            }
+
+        # one session per inference thread: each gets its own cuda stream, so
+        # batches from different threads overlap on the gpu instead of queueing
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = 1  # threads already run in parallel
+
+        sessions = []
+        for session_idx in range(n_inference_threads):
+            with self.startup_profiler.step(f"InferenceSession {session_idx}"):
+                sessions.append(
+                    onnxruntime.InferenceSession(
+                        model_name,
+                        sess_options=session_options,
+                        providers=[
+                            ("TensorrtExecutionProvider", trt_options),
+                            "CUDAExecutionProvider",
+                        ],
+                    )
+                )
+        self.detector = Detector(
+            sessions,
+            input_name,
+            input_height,
+            input_width,
+            dynamic_batch,
+            max_batch_size,
+        )
 
-        model_outputs = self.session.get_outputs()
-        self.output_names = [model_outputs[i].name for i in range(len(model_outputs))]
+        # concurrent requests are gathered into batches, which run off the event loop
+        self.batcher = Coalescer(self.run_batch, batch_window_ms, max_batch_size)
+        self.executor = ThreadPoolExecutor(
+            max_workers=n_inference_threads, thread_name_prefix="yolo"
+        )
 
-        # warm up model
+        # warm up model through the same paths requests take, so the first
+        # ones after a (snapshot) restore don't pay for lazy init
 
         frame = np.random.randint(0, 256, (Y_SIZE, X_SIZE, 3), dtype=np.uint8)
+        with self.startup_profiler.step("warmup (full frame)"):
+            self.detector.detect([0, 1], frame, return_objects=False)
+        with self.startup_profiler.step("warmup (preprocessed)"):
+            input_img = np.zeros((input_height, input_width, 3), dtype=np.uint8)
+            self.detector.detect(
+                [0, 1], input_img=input_img, frame_size=(X_SIZE, Y_SIZE)
+            )
+        for session_idx in range(n_inference_threads):  # sessions are used round robin
+            with self.startup_profiler.step(
+                f"warmup (batch of {max_batch_size}, session {session_idx})"
+            ):
+                self.detector.detect_batch(
+                    [{"character_ids": [0, 1], "frame": frame}] * max_batch_size
+                )
 
-        self.img_height, self.img_width = frame.shape[:2]
-        input_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        input_img = cv2.resize(input_img, (self.input_width, self.input_height))
-
-        input_img = input_img / 255.0
-        input_img = input_img.transpose(2, 0, 1)
-        input_tensor = input_img[np.newaxis, :, :, :].astype(np.float16)
-
-        _ = self.session.run(
-            self.output_names,
-            {self.input_names[0]: input_tensor},
-        )
+        self.startup_profiler.print_report()
 
     @modal.method()
     async def boot(self):  # so don't have to call `detect_characters` to boot
         pass
 
+    @modal.method()
+    async def get_startup_report(self) -> dict:
+        return {
+            **self.startup_profiler.get_report(),
+            "imports": profile_imports(["cv2", "numpy", "onnx", "onnxruntime"]),
+        }
+
+    @modal.method()
+    async def get_input_spec(self) -> dict:
+        # lets clients pick a payload, see YOLOClient.negotiate
+        return {
+            "input_size": (self.detector.input_width, self.detector.input_height),
+            "encodings": encodings,
+        }
+
+    @modal.method()
+    async def get_batch_stats(self) -> dict:
+        return self.batcher.get_stats()
+
     @modal.method()
     async def detect_characters(
         self,
         character_ids: list[int],
-        frame=None,
+        frame=None,  # array or encoded payload, see codec.py
         confidence_threshold: float = 0.0,
         use_dummy_frame: bool = False,
         return_objects: bool = True,
+        input_img=None,  # same
+        frame_size: tuple[int, int] | None = None,
+        return_timings: bool = False,  # also return per-stage timings for benchmarks
     ):
-        import cv2
-        import numpy as np
-
-        # prepare frame
-
-        if use_dummy_frame:
-            frame = np.random.randint(0, 256, (Y_SIZE, X_SIZE, 3), dtype=np.uint8)
-
-        self.img_height, self.img_width = frame.shape[:2]
-        input_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        input_img = cv2.resize(input_img, (self.input_width, self.input_height))
-
-        input_img = input_img / 255.0
-        input_img = input_img.transpose(2, 0, 1)
-        input_tensor = input_img[np.newaxis, :, :, :].astype(np.float16)
-
-        # run inference
-
-        outputs = self.session.run(
-            self.output_names,
-            {self.input_names[0]: input_tensor},
+        return await self.submit(
+            {
+                "character_ids": character_ids,
+                "frame": frame,
+                "confidence_threshold": confidence_threshold,
+                "use_dummy_frame": use_dummy_frame,
+                "return_objects": return_objects,
+                "input_img": input_img,
+                "frame_size": frame_size,
+                "return_timings": return_timings,
+            }
         )
 
-        # postprocess
-
-        predictions = np.squeeze(outputs[0])
-        scores = predictions[:, 4]
-        class_ids = predictions[:, 5].astype(int)
-
-        ## filter by confidence
-
-        confidence_mask = scores >= confidence_threshold
-        predictions = predictions[confidence_mask]
-        scores = scores[confidence_mask]
-        class_ids = class_ids[confidence_mask]
-
-        character_mask = np.isin(class_ids, character_ids)
-        filtered_predictions = predictions[character_mask]
-        filtered_scores = scores[character_mask]
-        filtered_class_ids = class_ids[character_mask]
-
-        final_predictions = []
-        final_class_ids = []
-        for char_id in character_ids:
-            char_mask = filtered_class_ids == char_id
-            if np.any(char_mask):
-                char_predictions = filtered_predictions[char_mask]
-                char_scores = filtered_scores[char_mask]
-                best_idx = np.argmax(char_scores)
-                final_predictions.append(char_predictions[best_idx])
-                final_class_ids.append(char_id)
-            else:
-                final_predictions.append(
-                    np.array([0, 0, 0, 0, 0, -1], dtype=np.float32)
-                )
-                final_class_ids.append(-1)
-
-        filtered_predictions = np.array(final_predictions)
-        filtered_class_ids = np.array(final_class_ids)
-
-        ## resize boxes to original frame size
-
-        boxes = filtered_predictions[:, :4]
-        input_shape = np.array(
-            [
-                self.input_width,
-                self.input_height,
-                self.input_width,
-                self.input_height,
-            ]
-        )
-        boxes = np.divide(boxes, input_shape, dtype=np.float32)
-        boxes *= np.array(
-            [self.img_width, self.img_height, self.img_width, self.img_height]
+    @modal.method()
+    async def detect_characters_batch(self, requests: list[dict]) -> list:
+        # coalesced by the client, see gateway.py, and batched again with other callers
+        # failures are returned in place, so the client fails only their callers
+        return await asyncio.gather(
+            *[self.submit(request) for request in requests], return_exceptions=True
         )
 
-        boxes[:, 0] = np.clip(boxes[:, 0], 0, self.img_width)  # xmin
-        boxes[:, 1] = np.clip(boxes[:, 1], 0, self.img_height)  # ymin
-        boxes[:, 2] = np.clip(boxes[:, 2], 0, self.img_width)  # xmax
-        boxes[:, 3] = np.clip(boxes[:, 3], 0, self.img_height)  # ymax
-
-        print(f"Detected {np.sum(filtered_class_ids != -1)} characters")
-
-        if return_objects:
-            return boxes.tolist(), filtered_class_ids.tolist()
+    async def submit(self, request: dict):
+        start = time.perf_counter()
+        result = await self.batcher.submit(request)
+        if request.get("return_timings") and result is not None:
+            # includes waiting for the batch window and a free session
+            result[2]["server_s"] = time.perf_counter() - start
+        return result
+
+    async def run_batch(self, requests: list[dict]) -> list:
+        # session.run, cv2 and numpy release the gil, so batches run in parallel
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.detector.detect_batch, requests
+        )
 
 
 @app.local_entrypoint()
 async def main(
     n_samples: int = 100,
+    concurrency: str = "1",  # comma-separated, e.g. 1,8,64,512
 ):
     import random
-    import time
 
     print("Booting detector...")
     start_time = time.perf_counter()
@@ -231,8 +250,7 @@ async def main(
     detector.boot.remote()
     print(f"Detector booted in {time.perf_counter() - start_time:.2f}s")
 
-    latencies = []
-    for _ in range(n_samples):
+    async def detect(latencies: list[float]):
         start_time = time.perf_counter()
         await detector.detect_characters.remote.aio(
             character_ids=[
@@ -245,14 +263,462 @@ async def main(
         latencies.append((time.perf_counter() - start_time) * 1000)
 
     percentiles = [50, 90, 95, 99]
-    sorted_latencies = sorted(latencies)
+    for n_concurrent in [int(n) for n in concurrency.split(",")]:
+        # each worker sends its next request as soon as the previous one returns
+        n_requests = max(n_samples, n_concurrent)
+        latencies = []
+
+        async def worker(n: int, latencies: list[float] = latencies):
+            for _ in range(n):
+                await detect(latencies)
+
+        stats_before = await detector.get_batch_stats.remote.aio()
+        start_time = time.perf_counter()
+        await asyncio.gather(
+            *[
+                worker(n_requests // n_concurrent + (idx < n_requests % n_concurrent))
+                for idx in range(n_concurrent)
+            ]
+        )
+        elapsed = time.perf_counter() - start_time
+        stats_after = await detector.get_batch_stats.remote.aio()
+
+        n_batches = stats_after["n_batches"] - stats_before["n_batches"]
+        # get_batch_stats calls land on one container, so this assumes a single container
+        avg_batch_size = n_requests / max(n_batches, 1)
+
+        sorted_latencies = sorted(latencies)
+        results = {}
+        for p in percentiles:
+            idx = int(len(sorted_latencies) * p / 100)
+            idx = min(max(idx - 1, 0), len(sorted_latencies) - 1)
+            results[p] = sorted_latencies[idx]
+        print("--------------------------------")
+        print(f"Concurrency {n_concurrent} ({n_requests} requests):")
+        print(f"  throughput: {n_requests / elapsed:.2f} frames/s")
+        print(f"  avg batch size: {avg_batch_size:.2f}")
+        print("  latency percentiles (ms):")
+        for p in percentiles:
+            print(f"    p{p}: {results[p]:.2f}ms")
+    print("--------------------------------")
+
+
+def load_val_frames(n_samples: int) -> list:
+    import random
+
+    import cv2
+
+    # synthetic validation scenes look far more like game frames than noise does
+    cache_volume.reload()
+    scene_paths = sorted((cache_path / "dataset" / "images" / "val").glob("*.png"))
+    if not scene_paths:
+        raise ValueError("No validation scenes found, run src.training.yolo --prepare")
+    random.seed(seed)
+    return [
+        cv2.resize(cv2.imread(str(path)), (X_SIZE, Y_SIZE))
+        for path in random.sample(scene_paths, min(n_samples, len(scene_paths)))
+    ]
+
+
+@app.function(
+    image=onnx_image, volumes={cache_path: cache_volume}, timeout=30 * minutes
+)
+async def benchmark_transport(n_samples: int = 200) -> dict:
+    import pickle
+
+    import numpy as np
+
+    frames = load_val_frames(n_samples)
+
+    detector = YOLOServer()
+    await detector.boot.remote.aio()
+
+    raw_client = YOLOClient(detector, max_batch_size=1)
+    await raw_client.negotiate("raw")
+    character_ids = [0, 1]
+
     results = {}
-    for p in percentiles:
-        idx = int(len(sorted_latencies) * p / 100)
-        idx = min(max(idx - 1, 0), len(sorted_latencies) - 1)
-        results[p] = sorted_latencies[idx]
+    raw_boxes = []
+    for encoding in encodings:
+        client = YOLOClient(detector, max_batch_size=1)
+        await client.negotiate(encoding)
+
+        latencies, n_bytes, pixel_errors, box_errors = [], [], [], []
+        for frame_idx, frame in enumerate(frames):
+            # what goes over the wire vs the same downscaled image unencoded
+            payload = client.prepare({"frame": frame})
+            n_bytes.append(len(pickle.dumps(payload)))
+            reference = raw_client.prepare({"frame": frame})
+            key = "frame" if reference["frame"] is not None else "input_img"
+            pixel_errors.append(
+                np.abs(
+                    decode_image(payload[key]).astype(np.int16) - reference[key]
+                ).max()
+            )
+
+            start = time.perf_counter()  # includes client-side encoding
+            boxes, _ = await client.detect_characters(character_ids, frame=frame)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            if encoding == "raw":
+                raw_boxes.append(boxes)
+            box_errors.append(np.abs(np.array(boxes) - raw_boxes[frame_idx]).max())
+
+        results[encoding] = {
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p90": float(np.percentile(latencies, 90)),
+            "kb_per_request": float(np.mean(n_bytes)) / 1024,
+            "max_pixel_error": int(np.max(pixel_errors)),
+            "max_box_error_px": float(np.max(box_errors)),
+        }
+    return results
+
+
+@app.local_entrypoint()
+async def benchmark_encodings(n_samples: int = 200):
+    results = await benchmark_transport.remote.aio(n_samples)
     print("--------------------------------")
-    print("Latency percentiles (ms):")
-    for p in percentiles:
-        print(f"  p{p}: {results[p]:.2f}ms")
+    print("Detector rpc per payload encoding:")
+    for encoding, stats in results.items():
+        print(
+            f"  {encoding}: {stats['kb_per_request']:.1f}KB,"
+            f" p50 {stats['latency_ms_p50']:.2f}ms, p90 {stats['latency_ms_p90']:.2f}ms,"
+            f" max pixel error {stats['max_pixel_error']},"
+            f" max box error {stats['max_box_error_px']:.2f}px"
+        )
+    print("--------------------------------")
+
+
+@app.function(image=onnx_image, cpu=4, timeout=10 * minutes)
+def benchmark_preprocessing(
+    n_frames: int = 1024,
+    input_size: tuple[int, int] = (640, 640),  # (width, height)
+) -> dict:
+    import cv2
+    import numpy as np
+
+    input_width, input_height = input_size
+    frames = np.random.randint(0, 256, (n_frames, Y_SIZE, X_SIZE, 3), dtype=np.uint8)
+
+    def before(frame):  # per-frame path this replaced
+        input_img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        input_img = cv2.resize(input_img, (input_width, input_height))
+        input_img = input_img / 255.0
+        input_img = input_img.transpose(2, 0, 1)
+        return input_img[np.newaxis, :, :, :].astype(np.float16)
+
+    results = {}
+
+    start = time.perf_counter()
+    for frame in frames:
+        before(frame)
+    results["before"] = (time.perf_counter() - start) * 1000 / n_frames
+
+    for batch_size in [1, max_batch_size]:
+        buffers = FrameBuffers(batch_size, input_height, input_width)
+        start = time.perf_counter()
+        for batch_start in range(0, n_frames, batch_size):
+            batch = frames[batch_start : batch_start + batch_size]
+            for idx, frame in enumerate(batch):
+                buffers.prepare(idx, frame)
+            buffers.to_tensor(len(batch))
+        results[f"after (batch of {batch_size})"] = (
+            (time.perf_counter() - start) * 1000 / n_frames
+        )
+
+    # the new path should produce the same tensor, up to fp16 rounding
+    buffers = FrameBuffers(1, input_height, input_width)
+    buffers.prepare(0, frames[0])
+    max_abs_diff = np.abs(
+        buffers.to_tensor(1).astype(np.float32) - before(frames[0]).astype(np.float32)
+    ).max()
+    return {"ms_per_frame": results, "max_abs_diff": float(max_abs_diff)}
+
+
+@app.local_entrypoint()
+async def benchmark_preprocess(
+    n_frames: int = 1024,
+    input_size: str = "640x640",  # width x height, 384x224 for native-aspect exports
+):
+    width, height = (int(n) for n in input_size.split("x"))
+    results = await benchmark_preprocessing.remote.aio(n_frames, (width, height))
+    print("--------------------------------")
+    print(f"Preprocessing time per frame to {input_size} (CPU):")
+    for name, ms in results["ms_per_frame"].items():
+        print(f"  {name}: {ms:.3f}ms")
+    print(f"  max abs difference: {results['max_abs_diff']:.5f}")
+    print("--------------------------------")
+
+
+@app.function(
+    image=onnx_image, cpu=8, volumes={cache_path: cache_volume}, timeout=30 * minutes
+)
+async def benchmark_cpu_backend(
+    n_samples: int = 200,
+    concurrency: int = 8,
+    n_sessions: int = 4,
+    n_threads: int = 2,
+) -> dict:
+    import numpy as np
+
+    frames = load_val_frames(n_samples)
+    character_ids = [0, 1]
+
+    detector = YOLOServer()
+    await detector.boot.remote.aio()
+    remote = YOLOClient(detector)
+    await remote.negotiate("png")
+    local = LocalYOLOClient(cpu_model_name, n_sessions=n_sessions, n_threads=n_threads)
+
+    results = {}
+    boxes = {}
+    for name, client in [("remote", remote), ("cpu", local)]:
+        await client.detect_characters(character_ids, frame=frames[0])  # warmup
+
+        # one session at a time, as in a single match
+        latencies, boxes[name] = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            frame_boxes, _ = await client.detect_characters(character_ids, frame=frame)
+            latencies.append((time.perf_counter() - start) * 1000)
+            boxes[name].append(frame_boxes)
+
+        # many sessions sharing one container
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def detect(frame, client=client, semaphore=semaphore):
+            async with semaphore:
+                await client.detect_characters(character_ids, frame=frame)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[detect(frame) for frame in frames])
+        elapsed = time.perf_counter() - start
+
+        results[name] = {
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p90": float(np.percentile(latencies, 90)),
+            "frames_per_s": len(frames) / elapsed,
+        }
+
+    # the cpu model runs in fp32, boxes should still agree with the gpu's
+    results["max_box_error_px"] = float(
+        max(
+            np.abs(np.array(cpu_boxes) - np.array(remote_boxes)).max()
+            for cpu_boxes, remote_boxes in zip(boxes["cpu"], boxes["remote"])
+        )
+    )
+    return results
+
+
+@app.local_entrypoint()
+async def benchmark_backends(
+    n_samples: int = 200,
+    concurrency: int = 8,
+    n_sessions: int = 4,
+    n_threads: int = 2,
+):
+    results = await benchmark_cpu_backend.remote.aio(
+        n_samples, concurrency, n_sessions, n_threads
+    )
+    print("--------------------------------")
+    print(f"Detector backends ({concurrency} concurrent for throughput):")
+    for name in ["remote", "cpu"]:
+        stats = results[name]
+        print(
+            f"  {name}: p50 {stats['latency_ms_p50']:.2f}ms,"
+            f" p90 {stats['latency_ms_p90']:.2f}ms,"
+            f" {stats['frames_per_s']:.1f} frames/s"
+        )
+    print(f"  max box error: {results['max_box_error_px']:.2f}px")
+    print("--------------------------------")
+
+
+# benchmark suite
+
+benchmark_providers = ["gpu", "cpu"]  # remote YOLOServer vs in-process onnxruntime
+benchmark_stages = ["preprocess", "inference", "postprocess", "queue", "rpc"]
+
+
+@app.function(
+    image=onnx_image, cpu=8, volumes={cache_path: cache_volume}, timeout=60 * minutes
+)
+async def benchmark_suite(
+    providers: tuple[str, ...] = tuple(benchmark_providers),
+    concurrency: tuple[int, ...] = (1, 8, 64, 512),  # calls in flight
+    batch_sizes: tuple[int, ...] = (1, 8, 32),  # frames per call
+    n_samples: int = 512,  # frames per run, at least concurrency * batch size
+    encoding: str = "png",  # gpu payloads, see codec.py
+    n_cpu_sessions: int = 4,
+    n_cpu_threads: int = 2,
+) -> dict:
+    import random
+
+    import numpy as np
+
+    frames = load_val_frames(n_samples)
+    random.seed(seed)
+    character_ids = [
+        random.sample(list(CHARACTER_MAPPING.keys()), 2) for _ in range(len(frames))
+    ]
+
+    def create_request(idx: int) -> dict:
+        return {
+            "character_ids": character_ids[idx % len(frames)],
+            "frame": frames[idx % len(frames)],
+            "return_timings": True,
+        }
+
+    async def run(detect, batch_size: int, n_concurrent: int) -> dict:
+        n_frames = max(n_samples, n_concurrent * batch_size)
+        calls = iter(range(0, n_frames, batch_size))
+        latencies = []
+        stage_times = {stage: [] for stage in benchmark_stages}
+        server_batch_sizes = []
+        n_failed = 0
+
+        async def worker():
+            nonlocal n_failed
+            # each worker makes its next call as soon as the previous one returns
+            for call_start in calls:
+                requests = [
+                    create_request(idx)
+                    for idx in range(call_start, min(call_start + batch_size, n_frames))
+                ]
+                start = time.perf_counter()
+                try:
+                    results = await detect(requests)
+                except Exception as e:  # the whole call failed
+                    results = [e] * len(requests)
+                total = time.perf_counter() - start
+                for result in results:
+                    if isinstance(result, BaseException):  # failed frames aren't timed
+                        n_failed += 1
+                        continue
+                    _, _, timings = result
+                    server = timings.get("server_s", total)
+                    compute = (
+                        timings["preprocess_s"]
+                        + timings["inference_s"]
+                        + timings["postprocess_s"]
+                    )
+                    latencies.append(total)
+                    stage_times["preprocess"].append(timings["preprocess_s"])
+                    stage_times["inference"].append(timings["inference_s"])
+                    stage_times["postprocess"].append(timings["postprocess_s"])
+                    stage_times["queue"].append(server - compute)
+                    stage_times["rpc"].append(total - server)
+                    server_batch_sizes.append(timings["batch_size"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(n_concurrent)])
+        elapsed = time.perf_counter() - start
+
+        return {
+            "batch_size": batch_size,
+            "concurrency": n_concurrent,
+            "n_frames": n_frames,
+            "n_failed": n_failed,
+            "frames_per_s": (n_frames - n_failed) / elapsed,
+            "latency_ms": {
+                f"p{p}": float(np.percentile(latencies, p)) * 1000
+                if latencies
+                else float("nan")
+                for p in [50, 90, 99]
+            },
+            # mean per frame, stage times are shared by every frame in a server batch
+            "stage_ms": {
+                stage: float(np.mean(times)) * 1000 if times else float("nan")
+                for stage, times in stage_times.items()
+            },
+            "avg_server_batch_size": float(np.mean(server_batch_sizes))
+            if server_batch_sizes
+            else float("nan"),
+        }
+
+    results = {
+        "n_scenes": len(frames),
+        "encoding": encoding,
+        "model": str(model_name),
+        "cpu_model": str(cpu_model_name),
+        "runs": [],
+    }
+    for provider in providers:
+        if provider == "gpu":
+            server = YOLOServer()
+            await server.boot.remote.aio()
+            client = YOLOClient(server, max_batch_size=1)  # batches are explicit here
+            await client.negotiate(encoding)
+
+            async def detect(
+                requests: list[dict], client=client, server=server
+            ) -> list:
+                # encoding happens on the client, so it counts as rpc time
+                requests = [client.prepare(request) for request in requests]
+                if len(requests) == 1:
+                    return [await server.detect_characters.remote.aio(**requests[0])]
+                return await server.detect_characters_batch.remote.aio(requests)
+
+        elif provider == "cpu":
+            local = LocalYOLOClient(cpu_model_name, n_cpu_sessions, n_cpu_threads)
+
+            async def detect(requests: list[dict], local=local) -> list:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    local.executor, local.detector.detect_batch, requests
+                )
+
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        await detect([create_request(0)])  # warmup
+        for batch_size in batch_sizes:
+            for n_concurrent in concurrency:
+                print(
+                    f"Running {provider}, batch {batch_size}, concurrency {n_concurrent}"
+                )
+                results["runs"].append(
+                    {
+                        "provider": provider,
+                        **await run(detect, batch_size, n_concurrent),
+                    }
+                )
+    return results
+
+
+@app.local_entrypoint()
+async def benchmark(
+    providers: str = ",".join(benchmark_providers),
+    concurrency: str = "1,8,64,512",
+    batch_sizes: str = "1,8,32",
+    n_samples: int = 512,
+    encoding: str = "png",
+    output: str = "yolo-benchmark.json",  # local path, diff against a previous run
+):
+    import json
+
+    results = await benchmark_suite.remote.aio(
+        providers.split(","),
+        [int(n) for n in concurrency.split(",")],
+        [int(n) for n in batch_sizes.split(",")],
+        n_samples,
+        encoding,
+    )
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("--------------------------------")
+    print(f"YOLO benchmark ({results['n_scenes']} validation scenes, {encoding}):")
+    print(
+        "  provider batch concurrency   frames/s failed   p50 ms   p99 ms  "
+        + " ".join(f"{stage:>11}" for stage in benchmark_stages)
+    )
+    for run in results["runs"]:
+        print(
+            f"  {run['provider']:>8} {run['batch_size']:>5} {run['concurrency']:>11}"
+            f" {run['frames_per_s']:>10.1f} {run['n_failed']:>6}"
+            f" {run['latency_ms']['p50']:>8.2f}"
+            f" {run['latency_ms']['p99']:>8.2f}  "
+            + " ".join(f"{run['stage_ms'][stage]:>11.2f}" for stage in benchmark_stages)
+        )
+    print(f"  written to {output}")
     print("--------------------------------")